@@ -1,78 +1,301 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
+import os
 import time
-import datetime
 import json
+import asyncio
+import threading
+import signal
+import sys
 from random import randint
 import random
-import awsiot.greengrasscoreipc
+import awsiot.greengrasscoreipc.client as client
 from awsiot.greengrasscoreipc.model import (
     PublishToTopicRequest,
     PublishMessage,
-    JsonMessage
+    JsonMessage,
+    BinaryMessage,
+    SubscribeToTopicRequest,
+    SubscriptionResponseMessage,
+    UnauthorizedError
 )
+import localipc
+from telemetry import TelemetryGenerator
+from fleet import FleetSimulator, build_fleet
+import recorder
+from template import MessageTemplate
 
 
 TIMEOUT = 100
 publish_rate = 10
+# stamp every message with a sequence number and the monotonic publish time,
+# the websocket component uses them for its latency and loss stats
+trace_messages = True
 
-ipc_client = awsiot.greengrasscoreipc.connect()
+# IPC pub/sub: greengrass, local for a localipc.py broker listening on
+# PUBLISHER_IPC_SOCKET, or memory, see localipc.py
+ipc_transport = os.environ.get("PUBLISHER_IPC", "greengrass")
+ipc_socket = os.environ.get("PUBLISHER_IPC_SOCKET", "/tmp/localipc.sock")
+ipc_client = localipc.connect(ipc_transport, ipc_socket)
+
+# publishes waiting for their response from the nucleus, 0 waits for each
+# response before the next publish, above that publish_to_topic only blocks
+# when the window is full
+publish_window = int(os.environ.get("PUBLISHER_WINDOW", "0"))
+
+# single: one generate_message() every publish_rate seconds
+# bulk: TelemetryGenerator blocks of bulk_block messages, bulk_rate messages
+# per second (0 as fast as the publish window allows), seeded with bulk_seed
+publisher_mode = os.environ.get("PUBLISHER_MODE", "single")
+bulk_rate = float(os.environ.get("PUBLISHER_RATE", "1000"))
+bulk_block = int(os.environ.get("PUBLISHER_BLOCK", "1000"))
+bulk_seed = os.environ.get("PUBLISHER_SEED")
+fault_rate = float(os.environ.get("PUBLISHER_FAULT_RATE", "0.001"))
+# fleet: fleet_machines machines, or the ones listed in fleet_file, each on
+# its own topic, publishing fleet_rate messages per second on average
+fleet_machines = int(os.environ.get("PUBLISHER_MACHINES", "100"))
+fleet_file = os.environ.get("PUBLISHER_FLEET_FILE")
+fleet_rate = float(os.environ.get("PUBLISHER_FLEET_RATE", "1"))
+fleet_jitter = float(os.environ.get("PUBLISHER_FLEET_JITTER", "0.1"))
+fleet_topic = os.environ.get("PUBLISHER_TOPIC_PATTERN", "runscreen/{machine_id}")
+job_seconds = float(os.environ.get("PUBLISHER_JOB_SECONDS", "600"))
+stop_seconds = float(os.environ.get("PUBLISHER_STOP_SECONDS", "60"))
+# record: append the messages of record_topic to record_file, see recorder.py
+# replay: publish the messages of record_file with the recorded timing sped
+# up replay_speed times (0 as fast as possible), on their recorded topics or
+# all on replay_topic, recorded pauses longer than replay_max_gap seconds
+# are shortened (0 keeps them)
+record_file = os.environ.get("PUBLISHER_RECORD_FILE", "/tmp/publisher-recording.cbor")
+record_topic = os.environ.get("PUBLISHER_RECORD_TOPIC", "runscreen/#")
+replay_speed = float(os.environ.get("PUBLISHER_REPLAY_SPEED", "1"))
+replay_topic = os.environ.get("PUBLISHER_REPLAY_TOPIC")
+replay_max_gap = float(os.environ.get("PUBLISHER_REPLAY_MAX_GAP", "0"))
+replay_loop = os.environ.get("PUBLISHER_REPLAY_LOOP", "false").lower() in ("1", "true", "yes")
 
 # the topic name where the messages are to be published
 topic = "runscreen/topic"
 
 
 class IPCTopic:
-    
+
+    def __init__(self, window=publish_window):
+        # trace sequence numbers, per topic
+        self.seqs = {}
+        self.window = window
+        self.in_flight = threading.BoundedSemaphore(window) if window > 0 else None
+        # window of the publishes from the event loop, see publish_to_topic_async
+        self.loop_in_flight = None
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        # one publish request per topic, reused: activate() serializes the
+        # message before it returns
+        self.requests = {}
+        self.template = None
+
     #function to publish the message to the topic
     def publish_to_topic(self,topic_name,message):
+        self.publish_request(self.json_request(topic_name,message))
+
+    #function to publish the message to the topic from a coroutine, waiting
+    #for a slot in the window without blocking the event loop
+    async def publish_to_topic_async(self,topic_name,message):
+        loop = asyncio.get_running_loop()
+        if self.loop_in_flight is None:
+            self.loop_in_flight = asyncio.Semaphore(self.window or 1)
+        if not self.loop_in_flight.locked():
+            await self.loop_in_flight.acquire()
+        else:
+            # backpressure, wait for a slot in the window
+            try:
+                await asyncio.wait_for(self.loop_in_flight.acquire(), TIMEOUT)
+            except asyncio.TimeoutError:
+                raise TimeoutError("no publish completed within {}s".format(TIMEOUT))
+        try:
+            operation = ipc_client.new_publish_to_topic()
+            operation.activate(self.json_request(topic_name,message))
+            future = operation.get_response()
+        except Exception:
+            self.loop_in_flight.release()
+            raise
+        # completed on an IPC thread, the semaphore belongs to the loop
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._published_async, f))
+
+    #function to build the publish request of a json message, reused per topic
+    def json_request(self,topic_name,message):
+        if trace_messages:
+            seq = self.seqs.get(topic_name, 0) + 1
+            self.seqs[topic_name] = seq
+            message["trace"] = {"seq": seq, "mono": time.monotonic()}
+        request = self.requests.get(topic_name)
+        if request is None:
+            request = PublishToTopicRequest()
+            request.topic = topic_name
+            publish_message = PublishMessage()
+            publish_message.json_message = JsonMessage()
+            request.publish_message = publish_message
+            self.requests[topic_name] = request
+        request.publish_message.json_message.message = message
+        return request
+
+    #function to publish a binary message to the topic
+    def publish_binary_to_topic(self,topic_name,data):
         request = PublishToTopicRequest()
         request.topic = topic_name
-        publish_message = PublishMessage()
-        publish_message.json_message = JsonMessage()
-        publish_message.json_message.message = message
-        request.publish_message = publish_message
-        operation = ipc_client.new_publish_to_topic()
-        operation.activate(request)
-        future = operation.get_response()
-        future.result(TIMEOUT)
-
-    #function to generate the json message
+        request.publish_message = PublishMessage(binary_message=BinaryMessage(message=data))
+        self.publish_request(request)
+
+    #function to send the publish request, within the window when there is one
+    def publish_request(self,request):
+        if self.in_flight is not None:
+            # backpressure, wait for a slot in the window
+            if not self.in_flight.acquire(timeout=TIMEOUT):
+                raise TimeoutError("no publish completed within {}s".format(TIMEOUT))
+        try:
+            operation = ipc_client.new_publish_to_topic()
+            operation.activate(request)
+            future = operation.get_response()
+        except Exception:
+            if self.in_flight is not None:
+                self.in_flight.release()
+            raise
+        if self.in_flight is None:
+            future.result(TIMEOUT)
+            self.completed += 1
+        else:
+            future.add_done_callback(self._published)
+
+    #function called from an IPC thread when a publish of the window completes
+    def _published(self,future):
+        self._count(future)
+        self.in_flight.release()
+
+    #function called on the event loop when a publish_to_topic_async completes
+    def _published_async(self,future):
+        self._count(future)
+        self.loop_in_flight.release()
+
+    def _count(self,future):
+        with self.lock:
+            if future.exception() is not None:
+                self.failed += 1
+                print("Publish failed: {}".format(future.exception()))
+            else:
+                self.completed += 1
+
+    #function to wait for every publish in flight
+    def flush(self):
+        if self.in_flight is None:
+            return
+        acquired = 0
+        while acquired < self.window and self.in_flight.acquire(timeout=TIMEOUT):
+            acquired += 1
+        for _ in range(acquired):
+            self.in_flight.release()
+
+    #function to generate the json message, the static sections come from a
+    #template built on the first call and the message is reused by the next call
     def generate_message(self,quality_control,tool_status,msg):
         print("generate the json messageg")
-        sensor_data ={}
-        operating_parameters = {}
+        if self.template is None:
+            self.template = MessageTemplate(quality_control,tool_status,msg)
         qualitycontrolVal = random.choice(quality_control)
-        if qualitycontrolVal == 'Passed':
-            operating_parameters = {
-                "quality_control" : qualitycontrolVal,
-                "tool_status" : tool_status[0],
-                "message" : msg[0]
-            }
-        else:
-            operating_parameters = {
-                "quality_control" : qualitycontrolVal,
-                "tool_status" : tool_status[0],
-                "message" : msg[1]
-            }            
         power_curve = "{}".format(randint(300,400))
         wind_speed = "{}".format(round(random.uniform(5, 15), 2))
         wind_direction = "{}".format(round(random.uniform(150, 300), 2))
         lv_activepower = "{}".format(round(random.uniform(200.12, 300.66), 2))
-        sensor_data = {
-            "power_curve":power_curve,
-            "lv_activepower":lv_activepower,
-            "wind_speed": wind_speed,
-            "wind_direction":wind_direction
-        }
-    
-        message = {
-            "timestamp": str(datetime.datetime.now()),
-            "Operating Parameters": operating_parameters,
-            "Sensor Data": sensor_data
-        }
-        return message
+        return self.template.fill(qualitycontrolVal,power_curve,lv_activepower,wind_speed,wind_direction)
         
+#function to publish generated blocks of telemetry at bulk_rate messages per second
+def publish_bulk(ipctopic):
+    generator = TelemetryGenerator(seed=int(bulk_seed) if bulk_seed else None,
+                                   interval=1.0 / bulk_rate if bulk_rate > 0 else 0.001, fault_rate=fault_rate)
+    start = time.monotonic()
+    sent = 0
+    while True:
+        for message in generator.block(bulk_block):
+            if bulk_rate > 0:
+                # scheduled from the start, publishing late does not lower the rate
+                delay = start + sent / bulk_rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            ipctopic.publish_to_topic(topic, message)
+            sent += 1
+        print("Published {} messages - {} completed, {} failed".format(sent, ipctopic.completed, ipctopic.failed))
+
+#function to run the fleet simulator, printing its stats every 10 seconds
+async def publish_fleet(ipctopic):
+    seed = int(bulk_seed) if bulk_seed else None
+    machines = build_fleet(fleet_machines, fleet_topic, fleet_rate, jitter=fleet_jitter, seed=seed,
+                           job_seconds=job_seconds, stop_seconds=stop_seconds, fleet_file=fleet_file)
+    simulator = FleetSimulator(machines, ipctopic.publish_to_topic_async)
+    print("Simulating {} machines".format(len(machines)))
+    task = asyncio.ensure_future(simulator.run())
+    while not task.done():
+        await asyncio.wait([task], timeout=10)
+        print("Fleet: {} - {} completed, {} failed".format(simulator.stats(), ipctopic.completed, ipctopic.failed))
+    task.result()
+
+class RecordingHandler(client.SubscribeToTopicStreamHandler):
+    # runs on an IPC client thread, Recorder.write takes its own lock
+    def __init__(self,recording):
+        super().__init__()
+        self.recording = recording
+
+    def on_stream_event(self, event: SubscriptionResponseMessage) -> None:
+        received = time.time()
+        try:
+            if event.json_message is not None:
+                self.recording.write(event.json_message.context.topic, event.json_message.message, received)
+            else:
+                self.recording.write(event.binary_message.context.topic, event.binary_message.message, received)
+        except Exception as e:
+            print("Failed to record a message: {}".format(e))
+
+    def on_stream_error(self, error: Exception) -> bool:
+        print("Stream error while recording: {}".format(error))
+        return True
+
+    def on_stream_closed(self) -> None:
+        print("Recording stream closed")
+
+#function to record the messages of record_topic until interrupted
+def record():
+    recording = recorder.Recorder(record_file)
+    request = SubscribeToTopicRequest()
+    request.topic = record_topic
+    operation = ipc_client.new_subscribe_to_topic(RecordingHandler(recording))
+    try:
+        operation.activate(request).result(TIMEOUT)
+    except UnauthorizedError:
+        # subscribing is not allowed by default, see the recipe
+        print("Not authorized to subscribe to {}, record mode needs the pubsub:record access control policy".format(
+            record_topic))
+        recording.close()
+        raise
+    print("Recording {} to {} ({})".format(record_topic, record_file, recording.format))
+    # the nucleus stops components with SIGTERM, the last records get flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(10)
+            print("Recorded {} messages".format(recording.count))
+    finally:
+        operation.close()
+        recording.close()
+
+#function to replay record_file, the messages get a new trace
+def replay(ipctopic):
+    def publish(topic_name, message):
+        if isinstance(message, (bytes, bytearray)):
+            ipctopic.publish_binary_to_topic(replay_topic or topic_name, bytes(message))
+        else:
+            ipctopic.publish_to_topic(replay_topic or topic_name, message)
+    print("Replaying {} at {}".format(record_file, "{}x".format(replay_speed) if replay_speed > 0 else "max speed"))
+    sent = recorder.replay(record_file, publish, replay_speed, replay_max_gap, replay_loop)
+    ipctopic.flush()
+    print("Replayed {} messages - {} completed, {} failed".format(sent, ipctopic.completed, ipctopic.failed))
+
 obj_ipctopic = IPCTopic()
 # declare variables
 quality_control = ["Passed","Action Needed"]
@@ -92,16 +315,26 @@ msg = [
     }
 ]
 
-while True:
+if publisher_mode == "bulk":
+    publish_bulk(obj_ipctopic)
+elif publisher_mode == "record":
+    record()
+elif publisher_mode == "replay":
+    replay(obj_ipctopic)
+elif publisher_mode == "fleet":
+    # publishing must not wait for each response on the scheduler
+    asyncio.run(publish_fleet(IPCTopic(publish_window or 256)))
+else:
+    while True:
     
-    # retrieve the json message to be published
-    message = obj_ipctopic.generate_message(quality_control,tool_status,msg)
+        # retrieve the json message to be published
+        message = obj_ipctopic.generate_message(quality_control,tool_status,msg)
     
-    # publish the message  to the topic
-    obj_ipctopic.publish_to_topic(topic,message)
+        # publish the message  to the topic
+        obj_ipctopic.publish_to_topic(topic,message)
 
-    # print the message generated in the logs
-    message_json = json.dumps(message)
-    print("The published json message is: ",message_json)
+        # print the message generated in the logs
+        message_json = json.dumps(message)
+        print("The published json message is: ",message_json)
     
-    time.sleep(publish_rate)
+        time.sleep(publish_rate)
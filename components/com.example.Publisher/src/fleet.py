@@ -0,0 +1,149 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Simulation of a fleet of machines publishing telemetry, for plant scale
+load on one box.
+
+Every machine has its own topic, rate, jitter and job lifecycle: a job runs
+for a random time, the machine stops for a while, then restarts with a new
+job. One asyncio scheduler drives all the machines from a heap of due
+times. Due times are computed from each machine's start time, rather than
+by sleeping after each publish, so late publishes do not make the timing
+drift.
+"""
+import asyncio
+import heapq
+import json
+import random
+from telemetry import TelemetryGenerator
+
+RUNNING = 'running'
+STOPPED = 'stopped'
+RESTARTED = 'restarted'
+
+
+class Machine:
+
+    def __init__(self, machine_id, topic, rate, jitter, rng, seed=None, job_seconds=600.0, stop_seconds=60.0):
+        self.machine_id = machine_id
+        self.topic = topic
+        self.period = 1.0 / rate
+        # fraction of the period a publish may be early or late
+        self.jitter = jitter
+        self.rng = rng
+        self.job_seconds = job_seconds
+        self.stop_seconds = stop_seconds
+        self.generator = TelemetryGenerator(seed=seed, interval=self.period)
+        # filled before the scheduler starts, later refills are spread out
+        self.pending = self._block()
+        self.epoch = None
+        self.count = 0
+        self.sent = 0
+        self.job = 0
+        self.state = None
+        self.state_until = 0.0
+
+    def _block(self):
+        # reversed, messages are popped from the end
+        block = self.generator.block(256)
+        block.reverse()
+        return block
+
+    def start(self, now):
+        # machines start spread over one period, not all at once
+        self.epoch = now + self.rng.uniform(0.0, self.period)
+        self._start_job(now)
+        return self.epoch
+
+    def _start_job(self, now):
+        self.job += 1
+        self.state = RUNNING if self.job == 1 else RESTARTED
+        self.state_until = now + self.rng.expovariate(1.0 / self.job_seconds)
+
+    def next_due(self):
+        self.count += 1
+        offset = self.rng.uniform(-self.jitter, self.jitter) * self.period if self.jitter else 0.0
+        return self.epoch + self.count * self.period + offset
+
+    def message(self, now):
+        """The message of this tick, after moving along the job lifecycle."""
+        if now >= self.state_until:
+            if self.state == STOPPED:
+                self._start_job(now)
+            else:
+                self.state = STOPPED
+                self.state_until = now + self.rng.expovariate(1.0 / self.stop_seconds)
+        elif self.state == RESTARTED:
+            self.state = RUNNING
+        if not self.pending:
+            self.pending = self._block()
+        message = self.pending.pop()
+        message["machine_id"] = self.machine_id
+        message["job_id"] = "{}-job-{}".format(self.machine_id, self.job)
+        message["Operating Parameters"]["tool_status"] = self.state
+        if self.state == STOPPED:
+            message["Sensor Data"]["lv_activepower"] = "0.00"
+        self.sent += 1
+        return message
+
+
+def build_fleet(machines=100, topic_pattern='runscreen/{machine_id}', rate=1.0, rate_spread=0.5, jitter=0.1,
+                seed=None, job_seconds=600.0, stop_seconds=60.0, fleet_file=None):
+    """Machines read from ``fleet_file``, a JSON list of objects with
+    machine_id and optionally topic, rate and jitter, or ``machines``
+    generated ones with rates spread by ``rate_spread`` around ``rate``."""
+    rng = random.Random(seed)
+    if fleet_file:
+        with open(fleet_file) as f:
+            specs = json.load(f)
+    else:
+        specs = [{"machine_id": "machine-{:04d}".format(i + 1),
+                  "rate": rate * rng.uniform(1.0 - rate_spread, 1.0 + rate_spread)} for i in range(machines)]
+    fleet = []
+    for i, spec in enumerate(specs):
+        machine_id = spec["machine_id"]
+        fleet.append(Machine(machine_id, spec.get("topic") or topic_pattern.format(machine_id=machine_id),
+                             float(spec.get("rate", rate)), float(spec.get("jitter", jitter)),
+                             random.Random(rng.random()), None if seed is None else seed + i,
+                             job_seconds, stop_seconds))
+    return fleet
+
+
+class FleetSimulator:
+    """Publishes the messages of every machine with the coroutine
+    ``publish(topic, message)`` when they are due. It runs on the
+    scheduler's loop, so it must wait for the publish window with asyncio
+    rather than block."""
+
+    def __init__(self, machines, publish):
+        self.machines = machines
+        self.publish = publish
+        self.published = 0
+        self.max_lateness = 0.0
+
+    async def run(self, duration=None):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        due = [(machine.start(start), i) for i, machine in enumerate(self.machines)]
+        heapq.heapify(due)
+        while due:
+            when, i = due[0]
+            now = loop.time()
+            if duration and now - start >= duration:
+                return
+            if when > now:
+                await asyncio.sleep(when - now)
+                continue
+            machine = self.machines[i]
+            await self.publish(machine.topic, machine.message(now))
+            self.published += 1
+            self.max_lateness = max(self.max_lateness, now - when)
+            heapq.heapreplace(due, (machine.next_due(), i))
+            if self.published % 1000 == 0:
+                # let other tasks run while catching up
+                await asyncio.sleep(0)
+
+    def stats(self):
+        states = {}
+        for machine in self.machines:
+            states[machine.state] = states.get(machine.state, 0) + 1
+        return {'published': self.published, 'max_lateness': round(self.max_lateness, 4), 'states': states}
@@ -0,0 +1,163 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Recording of IPC messages to an append-only file, and replay of the
+recording with the original timing.
+
+Every record holds the wall clock receive time, the topic and the message,
+a JSON object or bytes. Two formats, told apart by the first byte of the
+file:
+
+- CBOR, the default when cbor2 is installed: records are 4 byte big endian
+  lengths followed by the CBOR array [time, topic, message]
+- JSON lines, for files ending in .jsonl or without cbor2: one object per
+  line with t, topic and json, or binary in base64
+
+Appending to an existing file keeps its format. A record cut short by a
+crash at the end of the file is ignored on reading.
+"""
+import base64
+import json
+import os
+import struct
+import threading
+import time
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+LENGTH = struct.Struct('>I')
+CBOR = 'cbor'
+JSON_LINES = 'jsonl'
+
+
+def file_format(path):
+    """Format of the recording at ``path``, or the one a new recording
+    there gets."""
+    try:
+        with open(path, 'rb') as f:
+            first = f.read(1)
+    except FileNotFoundError:
+        first = b''
+    if first:
+        return JSON_LINES if first == b'{' else CBOR
+    if path.endswith('.jsonl') or cbor2 is None:
+        return JSON_LINES
+    return CBOR
+
+
+class Recorder:
+    """Appends records to ``path``, from any thread. Writes are buffered,
+    a background thread flushes them every ``flush_seconds``."""
+
+    def __init__(self, path, flush_seconds=1.0):
+        self.path = path
+        self.format = file_format(path)
+        if self.format == CBOR and cbor2 is None:
+            raise RuntimeError("{} is a CBOR recording, install cbor2 to append to it".format(path))
+        self.file = open(path, 'ab')
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.count = 0
+        self.unflushed = 0
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_periodically, name='recorder-flush', daemon=True)
+        self.flusher.start()
+
+    def _encode(self, received, topic, message):
+        if self.format == CBOR:
+            data = cbor2.dumps([received, topic, message])
+            return LENGTH.pack(len(data)) + data
+        record = {'t': received, 'topic': topic}
+        if isinstance(message, (bytes, bytearray)):
+            record['binary'] = base64.b64encode(message).decode()
+        else:
+            record['json'] = message
+        return (json.dumps(record, separators=(',', ':')) + '\n').encode()
+
+    def write(self, topic, message, received=None):
+        data = self._encode(time.time() if received is None else received, topic, message)
+        with self.lock:
+            self.file.write(data)
+            self.count += 1
+            self.unflushed += 1
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.flush_seconds):
+            with self.lock:
+                if self.unflushed and not self.file.closed:
+                    self.file.flush()
+                    self.unflushed = 0
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            self.file.close()
+
+
+def _cbor_records(f):
+    while True:
+        header = f.read(LENGTH.size)
+        if len(header) < LENGTH.size:
+            return
+        length = LENGTH.unpack(header)[0]
+        data = f.read(length)
+        if len(data) < length:
+            return
+        received, topic, message = cbor2.loads(data)
+        yield received, topic, message
+
+
+def _json_records(f):
+    for line in f:
+        if not line.endswith(b'\n'):
+            # cut short while being written
+            return
+        record = json.loads(line)
+        if 'binary' in record:
+            yield record['t'], record['topic'], base64.b64decode(record['binary'])
+        else:
+            yield record['t'], record['topic'], record['json']
+
+
+def read(path):
+    """The (time, topic, message) records of the recording at ``path``."""
+    cbor = file_format(path) == CBOR
+    if cbor and cbor2 is None:
+        raise RuntimeError("{} is a CBOR recording, install cbor2 to read it".format(path))
+    with open(path, 'rb') as f:
+        if cbor:
+            yield from _cbor_records(f)
+        else:
+            yield from _json_records(f)
+
+
+def replay(path, publish, speed=1.0, max_gap=0.0, loop=False):
+    """Calls ``publish(topic, message)`` for every record of ``path`` with
+    the recorded time between messages divided by ``speed``, as fast as
+    possible when ``speed`` is 0. Recorded gaps longer than ``max_gap``
+    seconds are shortened to it, unless it is 0. With ``loop`` the
+    recording starts over at its end. Returns the messages published."""
+    if not os.path.exists(path):
+        raise FileNotFoundError("No recording at {}".format(path))
+    start = time.monotonic()
+    # recorded seconds since the start of the replay
+    offset = 0.0
+    sent = 0
+    while True:
+        previous = None
+        for received, topic, message in read(path):
+            if previous is not None:
+                gap = max(received - previous, 0.0)
+                offset += min(gap, max_gap) if max_gap > 0 else gap
+            previous = received
+            if speed > 0:
+                # scheduled from the start, a late publish does not delay the next ones
+                delay = start + offset / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            publish(topic, message)
+            sent += 1
+        if not loop or previous is None:
+            return sent
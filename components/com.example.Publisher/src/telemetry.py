@@ -0,0 +1,123 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Vectorized generator of wind turbine telemetry, for load tests.
+
+Messages have the shape of IPCTopic.generate_message() but are produced in
+blocks with NumPy: wind speed and direction drift as mean reverting random
+walks, the power follows the turbine power curve, and faults push the
+active power above the threshold for a while, reported as "Action Needed".
+The state carries over from one block to the next, and a seed makes the
+whole sequence reproducible.
+"""
+import datetime
+import numpy as np
+
+OPERATING_PARAMETERS = {
+    "Passed": {
+        "quality_control": "Passed",
+        "tool_status": "running",
+        "message": {"Job continues": {"Site Environment": "OK", "Recommended Action": "None"}},
+    },
+    "Action Needed": {
+        "quality_control": "Action Needed",
+        "tool_status": "running",
+        "message": {"Restart the job": {"Site Environment": "Output is higher than threshold",
+                                        "Recommended Action": "Monitor power output"}},
+    },
+}
+
+
+def power_curve(wind_speed, cut_in=3.0, rated_speed=12.0, rated_power=400.0, cut_out=25.0):
+    """Power of the turbine at ``wind_speed``, cubic between cut-in and
+    rated speed."""
+    ratio = np.clip((wind_speed - cut_in) / (rated_speed - cut_in), 0.0, 1.0)
+    power = rated_power * ratio ** 3
+    return np.where(wind_speed >= cut_out, 0.0, power)
+
+
+class TelemetryGenerator:
+    """Blocks of messages ``interval`` seconds apart.
+
+    ``fault_rate`` is the chance that a fault starts at any message, a fault
+    lasts ``fault_length`` messages on average.
+    """
+
+    def __init__(self, seed=None, interval=1.0, fault_rate=0.001, fault_length=20,
+                 mean_wind=11.5, mean_direction=225.0):
+        self.rng = np.random.default_rng(seed)
+        self.interval = interval
+        self.fault_rate = fault_rate
+        self.fault_length = fault_length
+        self.mean_wind = mean_wind
+        self.mean_direction = mean_direction
+        self.wind = mean_wind
+        self.direction = mean_direction
+        self.fault_left = 0
+        self.clock = datetime.datetime.now()
+
+    @staticmethod
+    def _revert(start, mean, theta, shocks):
+        # x[t] = x[t-1] + theta * (mean - x[t-1]) + shock[t], solved as a
+        # discounted cumulative sum so the block needs no Python loop
+        keep = 1.0 - theta
+        forced = shocks + theta * mean
+        values = np.empty_like(forced)
+        # in chunks, keep ** -n overflows for long blocks
+        for i in range(0, len(forced), 1024):
+            chunk = forced[i:i + 1024]
+            powers = keep ** np.arange(1, len(chunk) + 1)
+            values[i:i + 1024] = powers * (start + np.cumsum(chunk / powers))
+            start = values[i + len(chunk) - 1]
+        return values
+
+    def _faults(self, n):
+        starts = self.rng.random(n) < self.fault_rate
+        lengths = self.rng.geometric(1.0 / self.fault_length, n)
+        # remaining fault length at every message, a new fault restarts it
+        remaining = np.zeros(n, dtype=np.int64)
+        index = np.arange(n)
+        last_start = np.maximum.accumulate(np.where(starts, index, -1))
+        since = index - last_start
+        started = last_start >= 0
+        remaining[started] = lengths[last_start[started]] - since[started]
+        carried = np.maximum(self.fault_left - index, 0)
+        remaining = np.maximum(remaining, carried)
+        self.fault_left = max(int(remaining[-1]) - 1, 0)
+        return remaining > 0
+
+    def block(self, n):
+        """The next ``n`` messages."""
+        wind = np.clip(self._revert(self.wind, self.mean_wind, 0.02, self.rng.normal(0.0, 0.3, n)), 0.0, 30.0)
+        direction = self._revert(self.direction, self.mean_direction, 0.01, self.rng.normal(0.0, 1.5, n))
+        self.wind = float(wind[-1])
+        self.direction = float(direction[-1])
+
+        expected = power_curve(wind)
+        active = expected * self.rng.normal(0.8, 0.03, n)
+        faults = self._faults(n)
+        active = np.where(faults, expected * self.rng.uniform(1.15, 1.4, n), active)
+
+        seconds = (np.arange(n) * self.interval * 1e6).astype('timedelta64[us]')
+        times = np.datetime64(self.clock, 'us') + seconds
+        self.clock += datetime.timedelta(seconds=n * self.interval)
+        timestamps = np.char.replace(np.datetime_as_string(times, unit='us'), 'T', ' ').tolist()
+
+        # formatted once per column, like the strings of generate_message()
+        columns = zip(
+            timestamps,
+            faults.tolist(),
+            np.char.mod('%d', np.rint(expected)).tolist(),
+            np.char.mod('%.2f', active).tolist(),
+            np.char.mod('%.2f', wind).tolist(),
+            np.char.mod('%.2f', np.mod(direction, 360.0)).tolist(),
+        )
+        return [{
+            "timestamp": timestamp,
+            "Operating Parameters": dict(OPERATING_PARAMETERS["Action Needed" if fault else "Passed"]),
+            "Sensor Data": {
+                "power_curve": power,
+                "lv_activepower": activepower,
+                "wind_speed": speed,
+                "wind_direction": heading,
+            },
+        } for timestamp, fault, power, activepower, speed, heading in columns]
@@ -0,0 +1,51 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Runscreen messages built from a template, for publishing at high rates.
+
+The operating parameters of each quality control value are built once and
+shared by every message, and the message itself is one preallocated dict
+whose timestamp and sensor values are overwritten by every fill(). That
+works because a publish serializes the message before activate() returns,
+with the Greengrass IPC client and with localipc.py alike, so the dict is
+free again by the time the next message is due.
+"""
+import datetime
+
+
+class MessageTemplate:
+    """Messages of the shape of IPCTopic.generate_message().
+
+    ``msg[0]`` is the message of the "Passed" quality control value,
+    ``msg[1]`` the one of every other value, like in generate_message().
+    """
+
+    def __init__(self, quality_control, tool_status, msg):
+        self.operating_parameters = {
+            quality: {
+                "quality_control": quality,
+                "tool_status": tool_status[0],
+                "message": msg[0] if quality == 'Passed' else msg[1],
+            } for quality in quality_control
+        }
+        self.sensor_data = {
+            "power_curve": None,
+            "lv_activepower": None,
+            "wind_speed": None,
+            "wind_direction": None,
+        }
+        self.message = {
+            "timestamp": None,
+            "Operating Parameters": None,
+            "Sensor Data": self.sensor_data,
+        }
+
+    def fill(self, quality, power_curve, lv_activepower, wind_speed, wind_direction, timestamp=None):
+        """The message with these values, valid until the next fill(): copy
+        it to keep it, and do not change its operating parameters."""
+        self.sensor_data["power_curve"] = power_curve
+        self.sensor_data["lv_activepower"] = lv_activepower
+        self.sensor_data["wind_speed"] = wind_speed
+        self.sensor_data["wind_direction"] = wind_direction
+        self.message["timestamp"] = str(datetime.datetime.now()) if timestamp is None else timestamp
+        self.message["Operating Parameters"] = self.operating_parameters[quality]
+        return self.message
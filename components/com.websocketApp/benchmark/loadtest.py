@@ -0,0 +1,334 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Load test of the websocket component, runs offline on any Linux box.
+
+Starts a localipc broker and app.py against it (WEBSOCKET_IPC=local),
+connects N simulated Socket.IO clients that emit publish_msg, publishes
+runscreen messages at the requested rate and reports:
+
+- throughput: messages published and frames delivered per second
+- delivery ratio per client: share of the published messages it received
+- latency percentiles from publish to client, from the trace stamps
+- CPU (percent of one core) and peak RSS of the server processes
+
+Results are saved as JSON in --results for later comparison:
+
+    python3 loadtest.py --clients 100 --rate 50 --duration 30
+    python3 loadtest.py --clients 100 --rate 50 --env WEBSOCKET_BATCH_WINDOW_MS=20 \\
+        --label batched --compare results/<previous run>.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import socketio
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from localipc import Broker, LocalIPCClient  # noqa: E402
+from awsiot.greengrasscoreipc.model import (  # noqa: E402
+    JsonMessage,
+    PublishMessage,
+    PublishToTopicRequest,
+)
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+
+def runscreen_message(seq):
+    # same shape as generate_message() of the dummy publisher
+    return {
+        "timestamp": str(datetime.datetime.now()),
+        "Operating Parameters": {
+            "quality_control": random.choice(["Passed", "Action Needed"]),
+            "tool_status": "running",
+            "message": {"Job continues": {"Site Environment": "OK", "Recommended Action": "None"}},
+        },
+        "Sensor Data": {
+            "power_curve": "{}".format(random.randint(300, 400)),
+            "lv_activepower": "{}".format(round(random.uniform(200.12, 300.66), 2)),
+            "wind_speed": "{}".format(round(random.uniform(5, 15), 2)),
+            "wind_direction": "{}".format(round(random.uniform(150, 300), 2)),
+        },
+        "trace": {"seq": seq, "mono": time.monotonic()},
+    }
+
+
+class ProcessSampler:
+    """CPU time and RSS of a process and its children, read from /proc."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak_rss = 0
+        self.cpu_start = None
+        self.wall_start = None
+        self.cpu = 0.0
+
+    def _pids(self):
+        pids = [self.pid]
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/{}/stat'.format(entry)) as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                if int(fields[1]) == self.pid:
+                    pids.append(int(entry))
+            except OSError:
+                continue
+        return pids
+
+    def _sample(self):
+        cpu = 0
+        rss = 0
+        for pid in self._pids():
+            try:
+                with open('/proc/{}/stat'.format(pid)) as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                cpu += int(fields[11]) + int(fields[12])
+                with open('/proc/{}/status'.format(pid)) as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            rss += int(line.split()[1]) * 1024
+            except OSError:
+                continue
+        return cpu / CLOCK_TICKS, rss
+
+    async def run(self, interval=0.5):
+        self.cpu_start, _ = self._sample()
+        self.wall_start = time.monotonic()
+        while True:
+            cpu, rss = self._sample()
+            self.peak_rss = max(self.peak_rss, rss)
+            self.cpu = cpu
+            await asyncio.sleep(interval)
+
+    def summary(self):
+        wall = time.monotonic() - self.wall_start
+        return {
+            'cpu_percent': round(100.0 * (self.cpu - self.cpu_start) / wall, 1) if wall > 0 else None,
+            'peak_rss_mb': round(self.peak_rss / 1048576.0, 1),
+        }
+
+
+class SimulatedClient:
+    """Socket.IO client of the runscreen page, records the trace sequence
+    numbers it receives and their latency."""
+
+    def __init__(self, url, topics):
+        self.url = url
+        self.topics = topics
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.received = set()
+        self.latencies = []
+        self.frames = 0
+        self.sio.on('ipc_response', self._frame)
+        self.sio.on('ipc_response_batch', self._batch)
+        self.sio.on('connect', self._connected)
+
+    async def _connected(self):
+        await self.sio.emit('publish_msg', {'data': '', 'topics': self.topics})
+
+    def _receive(self, data):
+        now = time.monotonic()
+        trace = json.loads(data).get('trace') or {}
+        if 'seq' in trace:
+            self.received.add(trace['seq'])
+            self.latencies.append(now - trace['mono'])
+
+    async def _frame(self, frame):
+        self.frames += 1
+        self._receive(frame['data'])
+
+    async def _batch(self, batch):
+        self.frames += 1
+        for data in batch['data']:
+            self._receive(data)
+
+    async def connect(self):
+        await self.sio.connect(self.url, transports=['websocket'])
+
+    async def close(self):
+        await self.sio.disconnect()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("app.py did not listen on port {} within {}s".format(port, timeout))
+
+
+async def publish(client, topic, rate, duration):
+    """Publish at ``rate`` messages per second, returns the sequence
+    numbers published."""
+    interval = 1.0 / rate
+    seq = 0
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        seq += 1
+        request = PublishToTopicRequest(topic=topic, publish_message=PublishMessage(
+            json_message=JsonMessage(message=runscreen_message(seq))))
+        client.new_publish_to_topic().activate(request)
+        # absolute schedule, a late iteration does not slow the rate down
+        await asyncio.sleep(max(0.0, start + seq * interval - time.monotonic()))
+    return seq
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    path = os.path.join(workdir, 'localipc.sock')
+    port = free_port()
+    broker = Broker()
+    await broker.serve(path)
+    env = dict(os.environ)
+    env.update({
+        'WEBSOCKET_IPC': 'local',
+        'WEBSOCKET_IPC_SOCKET': path,
+        'WEBSOCKET_PORT': str(port),
+        'WEBSOCKET_TOPICS': args.topic,
+        'WEBSOCKET_LOG_FILE': os.path.join(workdir, 'websocket_app.log'),
+        'WEBSOCKET_UI_FILE': os.path.join(SRC, 'app.html'),
+    })
+    for item in args.env:
+        key, value = item.split('=', 1)
+        env[key] = value
+    app = subprocess.Popen([sys.executable, os.path.join(SRC, 'app.py')], env=env, cwd=workdir,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    clients = []
+    try:
+        await wait_for_port(port, args.startup_timeout)
+        url = 'http://127.0.0.1:{}'.format(port)
+        clients = [SimulatedClient(url, [args.topic]) for _ in range(args.clients)]
+        for i in range(0, len(clients), 50):
+            await asyncio.gather(*(c.connect() for c in clients[i:i + 50]))
+        connected = sum(1 for c in clients if c.sio.connected)
+        print("{} clients connected, warming up {}s".format(connected, args.warmup))
+        await asyncio.sleep(args.warmup)
+        for c in clients:
+            # the last value snapshot sent on publish_msg is not part of the run
+            c.received.clear()
+            c.latencies.clear()
+            c.frames = 0
+
+        sampler = ProcessSampler(app.pid)
+        sampling = asyncio.ensure_future(sampler.run())
+        publisher = LocalIPCClient(path)
+        print("publishing {} messages/s for {}s".format(args.rate, args.duration))
+        started = time.monotonic()
+        published = await publish(publisher, args.topic, args.rate, args.duration)
+        await asyncio.sleep(args.drain)
+        elapsed = time.monotonic() - started
+        sampling.cancel()
+        publisher.close()
+        return summarize(args, clients, connected, published, elapsed, sampler.summary())
+    finally:
+        for c in clients:
+            if c.sio.connected:
+                await c.close()
+        app.terminate()
+        app.wait()
+        await broker.close()
+
+
+def summarize(args, clients, connected, published, elapsed, process):
+    latencies = sorted(l for c in clients for l in c.latencies)
+    ratios = sorted(len(c.received) / float(published) for c in clients) if published else []
+    delivered = sum(len(c.received) for c in clients)
+
+    def ms(seconds):
+        return None if seconds is None else round(seconds * 1000.0, 2)
+
+    return {
+        'label': args.label,
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'parameters': {
+            'clients': args.clients, 'rate': args.rate, 'duration': args.duration, 'topic': args.topic,
+            'env': args.env,
+        },
+        'connected': connected,
+        'published': published,
+        'throughput': {
+            'published_per_second': round(published / float(args.duration), 1),
+            'delivered_per_second': round(delivered / elapsed, 1),
+            'frames_per_second': round(sum(c.frames for c in clients) / elapsed, 1),
+        },
+        'delivery_ratio': {
+            'min': percentile(ratios, 0),
+            'p5': percentile(ratios, 5),
+            'mean': round(sum(ratios) / len(ratios), 4) if ratios else None,
+        },
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+        'server': process,
+    }
+
+
+def compare(result, previous):
+    print("\n{:<40} {:>14} {:>14}".format('', previous.get('label') or 'previous', result.get('label') or 'current'))
+    for section in ('throughput', 'delivery_ratio', 'latency_ms', 'server'):
+        for key, value in result[section].items():
+            before = previous.get(section, {}).get(key)
+            print("{:<40} {:>14} {:>14}".format('{}.{}'.format(section, key), str(before), str(value)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=50, help='simulated Socket.IO clients')
+    parser.add_argument('--rate', type=float, default=10, help='messages published per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of publishing')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds between connecting and publishing')
+    parser.add_argument('--drain', type=float, default=2, help='seconds to wait for late frames')
+    parser.add_argument('--topic', default='runscreen/topic')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='environment of app.py, e.g. WEBSOCKET_BATCH_WINDOW_MS=20')
+    parser.add_argument('--startup-timeout', type=float, default=30)
+    parser.add_argument('--label', default='', help='name of the run in the results')
+    parser.add_argument('--results', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results'))
+    parser.add_argument('--compare', help='results file of an earlier run')
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    os.makedirs(args.results, exist_ok=True)
+    name = 'loadtest-{}{}.json'.format(datetime.datetime.now().strftime('%Y%m%d-%H%M%S'),
+                                       '-' + args.label if args.label else '')
+    with open(os.path.join(args.results, name), 'w') as f:
+        json.dump(result, f, indent=2)
+    print("saved {}".format(os.path.join(args.results, name)))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Rolling windows of the Sensor Data fields, with aggregates and
+downsampled series for trend charts."""
+import time
+import numpy as np
+import config as cfg
+
+# named windows accepted by the sensor_aggregates event, in seconds
+WINDOWS = {'1m': 60, '1h': 3600}
+
+
+class RollingWindow:
+    """Ring of up to ``capacity`` (time, value) samples of one field. The
+    arrays start small and double until they reach ``capacity``."""
+
+    def __init__(self, capacity, initial=64):
+        self.capacity = capacity
+        size = min(initial, capacity)
+        self.times = np.zeros(size)
+        self.values = np.zeros(size)
+        self.count = 0
+        self.last = None
+
+    def _grow(self):
+        # only before the ring wraps, the samples are in order at the start
+        size = min(2 * self.times.size, self.capacity)
+        self.times = np.concatenate((self.times, np.zeros(size - self.times.size)))
+        self.values = np.concatenate((self.values, np.zeros(size - self.values.size)))
+
+    def append(self, t, value):
+        if self.count == self.times.size < self.capacity:
+            self._grow()
+        self.last = t
+        i = self.count % self.capacity
+        self.times[i] = t
+        self.values[i] = value
+        self.count += 1
+
+    def since(self, start):
+        """Samples taken at or after ``start``, oldest first."""
+        if self.count <= self.capacity:
+            times = self.times[:self.count]
+            values = self.values[:self.count]
+        else:
+            i = self.count % self.capacity
+            times = np.concatenate((self.times[i:], self.times[:i]))
+            values = np.concatenate((self.values[i:], self.values[:i]))
+        mask = times >= start
+        return times[mask], values[mask]
+
+
+def summarize(values):
+    if values.size == 0:
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'count': int(values.size),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'mean': float(values.mean()),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+    }
+
+
+def minmax_downsample(times, values, buckets):
+    """Keep the lowest and highest sample of each of ``buckets`` equal
+    slices, so peaks survive downsampling."""
+    n = values.size
+    if buckets <= 0 or n <= 2 * buckets:
+        return times, values
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    keep = []
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi > lo:
+            segment = values[lo:hi]
+            keep.append(lo + int(segment.argmin()))
+            keep.append(lo + int(segment.argmax()))
+    keep = np.unique(keep)
+    return times[keep], values[keep]
+
+
+class SensorAggregates:
+    """One rolling window per topic and Sensor Data field. The windows of a
+    topic without samples for ``idle_seconds`` are dropped."""
+
+    def __init__(self, fields=cfg.AGGREGATE_FIELDS, capacity=cfg.AGGREGATE_CAPACITY,
+                 idle_seconds=cfg.AGGREGATE_IDLE_SECONDS):
+        self.fields = fields
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self.windows = {}
+        self.checked = 0.0
+
+    def evict_idle(self, now=None):
+        now = time.time() if now is None else now
+        self.checked = now
+        cutoff = now - self.idle_seconds
+        for key in [key for key, window in self.windows.items() if window.last is None or window.last < cutoff]:
+            del self.windows[key]
+
+    def update(self, topic, message, now=None):
+        sensor_data = message.get('Sensor Data') if isinstance(message, dict) else None
+        if not isinstance(sensor_data, dict):
+            return
+        now = time.time() if now is None else now
+        if now - self.checked >= min(60.0, self.idle_seconds):
+            self.evict_idle(now)
+        for field in self.fields:
+            # the publisher sends the values as strings
+            try:
+                value = float(sensor_data[field])
+            except (KeyError, TypeError, ValueError):
+                continue
+            window = self.windows.get((topic, field))
+            if window is None:
+                window = self.windows[(topic, field)] = RollingWindow(self.capacity)
+            window.append(now, value)
+
+    def query(self, topic, seconds, points, now=None):
+        """Aggregates and a series of about ``points`` samples per field over
+        the last ``seconds``."""
+        now = time.time() if now is None else now
+        fields = {}
+        for field in self.fields:
+            window = self.windows.get((topic, field))
+            if window is None:
+                continue
+            times, values = window.since(now - seconds)
+            summary = summarize(values)
+            times, values = minmax_downsample(times, values, points // 2)
+            summary['times'] = times.tolist()
+            summary['values'] = values.tolist()
+            fields[field] = summary
+        return {'topic': topic, 'window': seconds, 'fields': fields}
@@ -2,105 +2,313 @@
 # SPDX-License-Identifier: MIT-0
 import time
 import json
-import os
 import asyncio
 from aiohttp import web
 import socketio
 import logging
-import queue
-import awsiot.greengrasscoreipc
-import awsiot.greengrasscoreipc.client as client
-from subscribe import MySubscriber
+from subscribe import TopicSubscriptions
+from broadcaster import Broadcaster
+from serializer import SocketIOJson
+from cache import LastValueCache, MessageHistory
+from delta import DeltaEncoder
+from aggregates import SensorAggregates, WINDOWS
+from tracing import LatencyTracer
+from loopmonitor import LoopLagMonitor, LoopWatchdog, timed
+from static import StaticFiles
+from workers import WorkerPool, WorkerSubscriptions
+from ringbuffer import SharedRing
+import metrics
+import serializer
+import transport
+import localipc
+import config as cfg
+from topics import covered_by_any
+from asynclog import setup_logging, stop_logging, hotpath
 import sys
 
-sio = socketio.AsyncServer(async_mode='aiohttp',cors_allowed_origins='*',logger=True, engineio_logger=True,ping_interval=20000,ping_timeout=60000)
-#Create and configure logger
-filePath = "codeOutput/logs"
-isExist = os.path.exists(filePath)
-if not isExist:
-    # Create a new directory because it does not exist
-    os.makedirs(filePath)
-    print("The new directory is created!")
-logging.basicConfig(filename="codeOutput/logs/websocket_app.log",
-                    format='%(asctime)s %(message)s',
-                    filemode='w')
+# transports, heartbeat, compression and packet logging are set in config.py
+sio = socketio.AsyncServer(async_mode='aiohttp',json=SocketIOJson,cors_allowed_origins='*',**transport.server_options())
+transport.install(sio)
+#Create and configure logger, written to WEBSOCKET_LOG_FILE from a background thread
+hotpath_rate_limit = setup_logging()
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
 logger.info("sio created :{} ".format(sio))
 app = web.Application()
 sio.attach(app)
 TIMEOUT = 50
 
-q = queue.Queue()
+# Topics to subscribe are set with WEBSOCKET_TOPICS, see config.py
+if cfg.WORKER_INDEX:
+    # worker process, the parent process holds the IPC subscriptions, see workers.py
+    subscriptions = WorkerSubscriptions(cfg.DEFAULT_TOPICS)
+else:
+    # the nucleus, or a stand-in for benchmarks and local runs, see localipc.py
+    ipc_client = localipc.connect(cfg.IPC, cfg.IPC_SOCKET)
+    # one IPC subscription per topic, however many clients watch it
+    subscriptions = TopicSubscriptions(ipc_client, cfg.DEFAULT_TOPICS)
+# rolling windows of the Sensor Data fields, served by sensor_aggregates
+aggregates = SensorAggregates()
+# recent messages and patches for the clients asking for delta frames
+delta_encoder = DeltaEncoder()
+# latency of every stage from the publisher to the browser ack
+tracer = LatencyTracer()
+# every client that emitted publish_msg receives the messages of the topics it watches
+broadcaster = Broadcaster(sio, delta=delta_encoder, tracer=tracer)
+# Socket.IO connections, subscribed to runscreen data or not
+connected = set()
+loop_lag = LoopLagMonitor()
+# logs the stack of any callback blocking the loop longer than WEBSOCKET_SLOW_CALLBACK_SECONDS
+watchdog = LoopWatchdog()
 
-# Topics to subscribe
-topic_run_screen = "runscreen/topic"
-ipc_client = awsiot.greengrasscoreipc.connect()
+metrics.REGISTRY.register(metrics.Gauge(
+    'websocket_connected_clients', 'Connected Socket.IO clients.', lambda: len(connected)))
+metrics.REGISTRY.register(metrics.Gauge(
+    'websocket_subscribed_clients', 'Clients receiving runscreen data.', lambda: len(broadcaster.clients)))
+metrics.REGISTRY.register(metrics.Gauge(
+    'websocket_client_queue_depth', 'Frames waiting in the buffer of each client.',
+    lambda: [({'sid': sid}, len(buffer)) for sid, buffer in broadcaster.clients.items()]))
+metrics.REGISTRY.register(metrics.Gauge(
+    'websocket_ipc_queue_depth', 'Messages handed over by the IPC threads, not yet fanned out.',
+    lambda: subscriptions.queue.qsize() if subscriptions.queue is not None else 0))
+metrics.REGISTRY.register(metrics.Counter(
+    'websocket_ring_lost_total', 'Messages a worker process missed because the shared ring overtook it.',
+    lambda: subscriptions.reader.lost if getattr(subscriptions, 'reader', None) is not None else 0))
+metrics.REGISTRY.register(metrics.Gauge(
+    'websocket_ipc_subscriptions', 'Open IPC topic subscriptions.', lambda: len(subscriptions.subscribers)))
+metrics.REGISTRY.register(metrics.Counter(
+    'websocket_messages_dropped_total', 'Frames dropped because a client buffer was full.',
+    lambda: broadcaster.stats()['dropped']))
+metrics.REGISTRY.register(metrics.Counter(
+    'websocket_messages_conflated_total', 'Pending frames replaced by a newer one for a slow client.',
+    lambda: broadcaster.stats()['conflated']))
+metrics.REGISTRY.register(metrics.Gauge(
+    'websocket_event_loop_lag_max_seconds', 'Largest event loop lag seen since start.', lambda: loop_lag.max_lag))
+metrics.REGISTRY.register(metrics.Gauge(
+    'websocket_event_loop_lag_seconds_last', 'Event loop lag of the last sample.', lambda: loop_lag.lag))
+# UI files, read and compressed once and served from memory
+ui_files = StaticFiles({'/app.html' if cfg.UI_DIR else '/': cfg.UI_FILE}, cfg.UI_DIR or None)
+ui_files.preload()
+# latest message per topic, sent to a client as soon as it emits publish_msg
+last_values = LastValueCache()
+# recent frames, replayed to a client that reconnects after missing some
+history = MessageHistory()
 
-#### function to subscribe to the topic, retrieve data from the topic and publish it to the front end
-async def serve(sio,sid,q):
-    sub_runscreen = MySubscriber(q)
-    logger.debug("Initiating ipc connection")
-    ipc_client = awsiot.greengrasscoreipc.connect()
-    sub_runscreen.subscribe(ipc_client,topic_run_screen)
+#### function to subscribe to the default topics once for the whole process and start the fan-out task
+async def start_subscription(app):
+    q = asyncio.Queue()
+    subscriptions.start(q,asyncio.get_running_loop())
+    sio.start_background_task(serve,sio,q)
+    sio.start_background_task(loop_lag.run)
+    watchdog.start()
+
+#### function to retrieve data from the topic queue and publish it to the front end
+async def serve(sio,q):
     while True:
         try:
-            await sio.sleep(1)
-            payload = q.get()
-            msg_json = str(payload)
-            logger.info("In try block  - Queue size is {}".format(q.qsize()))
-            logger.info("Message was read from queue at : {}".format(time.time()))
-            logger.info("the message is : {}".format(msg_json))
-            await sio.emit('ipc_response',{'data':msg_json},room=sid)
-            print("Message sent to socket at : {}".format(time.time()))
-            #time.sleep(1)
+            # wakes up as soon as the subscriber hands over a message
+            topic_filter, topic, payload, received, data, seq = await q.get()
+            metrics.MESSAGES_RECEIVED.inc()
+            # overlapping subscriptions (runscreen/# and runscreen/topic) each get a
+            # copy of the message, only one is numbered, stored and fanned out
+            if not subscriptions.delivers(topic_filter, topic):
+                continue
+            # lazy arguments, formatted by the log writer thread if the rate limit lets them through
+            hotpath.info("Message was read from queue at : %s - Queue size is %s", time.time(), q.qsize())
+            hotpath.info("the message on %s is : %s", topic, payload)
+            # worker processes get the message encoded and numbered by the parent
+            if data is None:
+                data = serializer.encode(payload)
+            frame = history.append(data, topic, seq=seq)
+            tracer.dequeue(topic, payload, received, frame['seq'])
+            last_values.update(topic, payload, frame)
+            delta_encoder.remember(frame, payload)
+            aggregates.update(topic, payload)
+            broadcaster.publish(topic_filter, payload, frame)
+            hotpath.debug("Message queued for clients at : %s", time.time())
         except Exception as e:
             print("encountered an exception -  {}".format(e))
             # This exception can happen when a client does not properly close
             # the websocket's connection, but it is irrelevant
     return
 
+#### function to serve the Prometheus metrics
+async def metrics_handler(request):
+    return web.Response(body=metrics.REGISTRY.render().encode(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+#### function to serve the UI, answers 304 to a browser that already has the file
+@timed('index')
 async def index(request):
-    with open('/tmp/app.html') as f:
-        return web.Response(text=f.read(), content_type='text/html')
+    return await ui_files.handle(request)
 
 @sio.event
 async def my_event(sid, message):
     await sio.emit('my_response', {'data': message['data']}, room=sid)
 
 
+#### function to pick what a client gets before live data: the frames it missed if it
+#### tells us what it saw last (since_seq or since timestamp), else the latest values.
+#### A since_seq of another epoch was numbered before a restart and means nothing now.
+def replay_frames(message, topics):
+    frames = []
+    if isinstance(message, dict):
+        if message.get('since_seq') is not None and history.knows(message.get('epoch')):
+            frames = history.since_seq(int(message['since_seq']), topics)
+        elif message.get('since') is not None:
+            frames = history.since_time(float(message['since']), topics)
+    return frames or last_values.snapshot(topics)
+
+#### function to read the topics a client asks for, the default topics if none.
+#### Filters not covered by WEBSOCKET_ALLOWED_TOPICS are ignored, so a client cannot
+#### make the component subscribe to the whole local pub/sub traffic
+def requested_topics(message):
+    topics = message.get('topics') if isinstance(message, dict) else None
+    if isinstance(topics, str):
+        topics = [topics]
+    if not topics:
+        return list(cfg.DEFAULT_TOPICS)
+    allowed = []
+    for topic in topics:
+        if isinstance(topic, str) and covered_by_any(cfg.ALLOWED_TOPICS, topic):
+            allowed.append(topic)
+        else:
+            logger.warning("Ignoring topic {!r} not covered by the allowed topics {}".format(topic, cfg.ALLOWED_TOPICS))
+    return allowed
+
 #### function to serve the frontend with runscreen data
 @sio.event
+@timed('publish_msg')
 async def publish_msg(sid,message):
     try:
         logger.info("In publish_msg")
-        await serve(sio,sid,q)
+        topics = requested_topics(message)
+        delta = isinstance(message, dict) and bool(message.get('delta'))
+        # binary frames for clients listing encodings they decode, e.g. ['cbor', 'msgpack']
+        encoding = serializer.negotiate(message.get('encodings')) if isinstance(message, dict) else None
+        # a malformed since/since_seq fails here, before anything is subscribed
+        frames = replay_frames(message, topics)
+        broadcaster.add(sid, topics, frames, delta, encoding)
+        # released by the disconnect handler once the client is in the broadcaster
+        for topic in topics:
+            subscriptions.subscribe(topic)
     except Exception as e:
         logger.info("An exception occured in publish_msg()! - {}".format(e))
 
 
+#### functions for delta clients: acknowledge an applied frame, or ask for a full one.
+#### Acks also measure the emit to browser round trip.
+@sio.event
+async def ack(sid,message):
+    try:
+        seq = int(message['seq'])
+        tracer.acked(sid, seq)
+        broadcaster.ack(sid, message['topic'], seq)
+    except Exception as e:
+        logger.info("An exception occured in ack()! - {}".format(e))
+
+
+@sio.event
+async def resync(sid,message):
+    try:
+        broadcaster.resync(sid, message['topic'])
+    except Exception as e:
+        logger.info("An exception occured in resync()! - {}".format(e))
+
+
+#### function to serve min/max/mean/percentiles and a downsampled series of the sensor
+#### fields of a topic over a window ('1m', '1h' or seconds), for trend charts
+@sio.event
+@timed('sensor_aggregates')
+async def sensor_aggregates(sid,message):
+    try:
+        message = message if isinstance(message, dict) else {}
+        topic = message.get('topic') or cfg.DEFAULT_TOPICS[0]
+        window = message.get('window', '1m')
+        seconds = WINDOWS[window] if window in WINDOWS else float(window)
+        points = int(message.get('points', 200))
+        await sio.emit('sensor_aggregates_response', aggregates.query(topic, seconds, points), room=sid)
+    except Exception as e:
+        logger.info("An exception occured in sensor_aggregates()! - {}".format(e))
+
+
+#### function to serve the p50/p95/p99 latency per stage and the publisher gap counts
+@sio.event
+async def latency_stats(sid,message=None):
+    await sio.emit('latency_stats_response', tracer.summary(), room=sid)
+
+
+#### function to stop sending some topics to a client
+@sio.event
+async def unsubscribe_topics(sid,message):
+    try:
+        for topic in broadcaster.unwatch(sid, requested_topics(message)):
+            subscriptions.release(topic)
+    except Exception as e:
+        logger.info("An exception occured in unsubscribe_topics()! - {}".format(e))
+
+
 @sio.event
 async def disconnect_request(sid):
     await sio.disconnect(sid)
 
 
 @sio.event
-async def connect(sid, environ):
+@timed('connect')
+async def connect(sid, environ, auth=None):
+    connected.add(sid)
     await sio.emit('my_response', {'data': 'Connected', 'count': 0}, room=sid)
 
 @sio.event
 def disconnect(sid):
+    connected.discard(sid)
+    for topic in broadcaster.remove(sid):
+        subscriptions.release(topic)
     print('Client disconnected')
     logger.info("In disconnect - Client disconnected")
 
 
+#### function to write out the queued log records when the server stops
+async def flush_logs(app):
+    stop_logging()
+
+
 #app.router.add_static('/static', 'static')
-app.router.add_get('/', index)
+app.router.add_get('/metrics', metrics_handler)
+# registered last so it does not shadow /socket.io/ and /metrics
+app.router.add_get('/{path:.*}', index)
+app.on_startup.append(start_subscription)
+app.on_cleanup.append(flush_logs)
+
+#### function to serve the metrics of a worker on its own port while the server
+#### runs, a scrape of the shared port reaches whichever worker accepts it
+async def worker_metrics(app):
+    metrics_app = web.Application()
+    metrics_app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(metrics_app, access_log=None)
+    await runner.setup()
+    port = cfg.METRICS_PORT + cfg.WORKER_INDEX - 1
+    await web.TCPSite(runner, port=port).start()
+    logger.info("worker {} serving /metrics on port {}".format(cfg.WORKER_INDEX, port))
+    yield
+    await runner.cleanup()
+
+#### function run by each worker process in multi process mode
+def run_worker(ring_name, control):
+    subscriptions.attach(SharedRing.attach(ring_name), control)
+    # the parent numbers the frames, its ring lives as long as that numbering
+    history.epoch = ring_name
+    logger.info("starting worker {}".format(cfg.WORKER_INDEX))
+    app.cleanup_ctx.append(worker_metrics)
+    web.run_app(app, port=cfg.PORT, reuse_port=True)
+
 
-if __name__ == '__main__':
+if __name__ == '__main__' and cfg.WORKERS > 1:
+    print("starting {} workers".format(cfg.WORKERS))
+    logger.info("starting {} workers".format(cfg.WORKERS))
+    asyncio.run(WorkerPool(subscriptions, run_worker).run())
+elif __name__ == '__main__':
     print("starting the server")
     logger.info("starting the server")
-    start_server = web.run_app(app)
+    start_server = web.run_app(app, port=cfg.PORT)
     asyncio.get_event_loop().run_until_complete(start_server)
     asyncio.get_event_loop().run_forever()
     
\ No newline at end of file
@@ -0,0 +1,181 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Logging that keeps file I/O off the event loop and the IPC threads.
+
+Records are put on a queue and written by a background thread, which
+flushes the file in batches, at once for warnings and errors, and when
+the queue stays empty for the flush interval. Per message logs go through
+the ``hotpath`` logger, rate limited per message template, and the raw
+messages through the optional ``audit`` logger, written to its own
+rotating file.
+"""
+import atexit
+import logging
+import logging.handlers as handlers
+import os
+import queue
+import threading
+import time
+import config as cfg
+
+LOG_FORMAT = '%(asctime)s %(message)s'
+
+# loggers used on the per message path
+hotpath = logging.getLogger('websocket.hotpath')
+audit = logging.getLogger('websocket.audit')
+audit.propagate = False
+
+_listeners = []
+
+
+class BufferedRotatingFileHandler(handlers.RotatingFileHandler):
+    """Rotating file handler flushing every ``flush_records`` records or
+    ``flush_interval`` seconds instead of after every record, and after
+    every record of level WARNING or above. Whoever writes to it calls
+    flush_due() when idle so a quiet period does not hold records back."""
+
+    def __init__(self, filename, mode='a', maxBytes=0, backupCount=0, flush_records=100, flush_interval=1.0):
+        super().__init__(filename, mode=mode, maxBytes=maxBytes, backupCount=backupCount)
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            if self.maxBytes > 0 and self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            self.pending += 1
+            if (record.levelno >= logging.WARNING or self.pending >= self.flush_records
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        super().flush()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def flush_due(self):
+        if self.pending and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+
+class FlushingQueueListener(handlers.QueueListener):
+    """Queue listener flushing its handlers whenever the queue stays empty
+    for ``flush_interval`` seconds."""
+
+    def __init__(self, log_queue, *handlers, flush_interval=1.0, **kwargs):
+        super().__init__(log_queue, *handlers, **kwargs)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.flush_interval)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush_due()
+
+
+class DeferredQueueHandler(handlers.QueueHandler):
+    """Queue handler that leaves formatting to the writer thread.
+
+    The standard QueueHandler formats the record in the logging thread so it
+    can be pickled, which is not needed for an in-process queue.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most ``rate`` records per second for each message
+    template and counts the others."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.allowance = {}
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.allowance.get(record.msg, (self.rate, now))
+            tokens = min(self.rate, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.allowance[record.msg] = (tokens, now)
+                self.suppressed += 1
+                return False
+            self.allowance[record.msg] = (tokens - 1, now)
+            return True
+
+
+def _flush_periodically(handler):
+    while True:
+        time.sleep(handler.flush_interval)
+        handler.acquire()
+        try:
+            handler.flush_due()
+        finally:
+            handler.release()
+
+
+def _queued(logger, handler):
+    # the logger only enqueues, a listener thread does the writing
+    if not cfg.LOG_ASYNC:
+        logger.addHandler(handler)
+        threading.Thread(target=_flush_periodically, args=(handler,), name='log-flush', daemon=True).start()
+        return
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = FlushingQueueListener(log_queue, handler, flush_interval=handler.flush_interval,
+                                     respect_handler_level=True)
+    listener.start()
+    _listeners.append((listener, handler))
+
+
+def setup_logging(filename=cfg.LOG_FILE, level=logging.INFO):
+    """Configure the root, hot path and audit loggers, returns the rate limit
+    filter of the hot path logger."""
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    handler = BufferedRotatingFileHandler(filename, mode='w', flush_records=cfg.LOG_FLUSH_RECORDS,
+                                          flush_interval=cfg.LOG_FLUSH_SECONDS)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.setLevel(level)
+    _queued(root, handler)
+
+    rate_limit = RateLimitFilter(cfg.HOTPATH_LOG_RATE)
+    hotpath.addFilter(rate_limit)
+
+    if cfg.AUDIT_LOG:
+        audit_handler = BufferedRotatingFileHandler(cfg.AUDIT_LOG, maxBytes=cfg.AUDIT_LOG_MAX_BYTES,
+                                                    backupCount=cfg.AUDIT_LOG_BACKUPS,
+                                                    flush_records=cfg.LOG_FLUSH_RECORDS,
+                                                    flush_interval=cfg.LOG_FLUSH_SECONDS)
+        audit_handler.setFormatter(logging.Formatter('%(message)s'))
+        audit.setLevel(logging.INFO)
+        _queued(audit, audit_handler)
+    else:
+        audit.disabled = True
+    atexit.register(stop_logging)
+    return rate_limit
+
+
+def stop_logging():
+    """Write out whatever is still queued."""
+    while _listeners:
+        listener, handler = _listeners.pop()
+        listener.stop()
+        handler.flush()
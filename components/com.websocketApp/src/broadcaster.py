@@ -0,0 +1,411 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import asyncio
+import collections
+import logging
+import time
+import config as cfg
+import serializer
+import metrics
+from delta import DeltaState
+from topics import topic_matches
+
+logger = logging.getLogger()
+
+# Policies applied when a client's outbound buffer is full
+DROP_OLDEST = 'drop_oldest'
+CONFLATE = 'conflate'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, CONFLATE, DISCONNECT)
+
+
+def conflation_key(message):
+    # messages carrying the same top level sections replace each other
+    if not isinstance(message, dict):
+        return None
+    key = tuple(k for k in cfg.CONFLATE_KEYS if k in message)
+    return key or None
+
+
+class ClientBuffer:
+    """Bounded outbound buffer of a single client.
+
+    With the conflate policy a pending message is replaced in place by a newer
+    one with the same conflation key, so a slow client always gets the latest
+    state instead of a backlog.
+    """
+
+    def __init__(self, maxsize, policy):
+        if policy not in POLICIES:
+            raise ValueError("Unknown buffer policy {}, expected one of {}".format(policy, POLICIES))
+        self.maxsize = maxsize
+        self.policy = policy
+        self.pending = collections.OrderedDict()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.conflated = 0
+        self._seq = 0
+        # the sender task is parked in get() on an empty buffer
+        self.waiting = False
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, message, key=None):
+        """Queue a message, returns False if the client must be disconnected.
+
+        ``key`` is the conflation key of the message, only used by the
+        conflate policy.
+        """
+        if self.policy != CONFLATE:
+            key = None
+        if key is not None and key in self.pending:
+            self.pending[key] = message
+            self.conflated += 1
+            return True
+        if key is None:
+            self._seq += 1
+            key = self._seq
+        if len(self.pending) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == DISCONNECT:
+                return False
+            self.pending.popitem(last=False)
+        self.pending[key] = message
+        self.ready.set()
+        return True
+
+    def idle(self):
+        """Nothing pending and the sender waiting, a frame emitted for this
+        client right now cannot overtake an earlier one."""
+        return self.waiting and not self.pending
+
+    async def wait(self):
+        """Wait until a message is pending, without taking it."""
+        while not self.pending:
+            self.ready.clear()
+            self.waiting = True
+            try:
+                await self.ready.wait()
+            finally:
+                self.waiting = False
+
+    def drain(self, limit):
+        messages = []
+        while self.pending and len(messages) < limit:
+            messages.append(self.pending.popitem(last=False)[1])
+        return messages
+
+
+class Broadcaster:
+    """Delivers every message from the shared IPC subscriptions to the
+    Socket.IO clients watching its topic.
+
+    The rooms (``self.rooms``, topic filter -> sids) are the broadcaster's
+    own, not Socket.IO rooms: every emit targets sids. Each client has its
+    own buffer and sender task, so a slow client only delays itself.
+    sio.emit() only queues the packet for the engine.io writer of the
+    socket, so a sender takes the next frame from the buffer only while
+    fewer than ``socket_backlog`` packets wait there; the frames of a client
+    that stopped reading stay in its buffer, where its policy applies.
+    Clients with nothing pending and room in their socket backlog get a
+    live frame from a single emit to all of them, so Socket.IO encodes the
+    packet once instead of once per client.
+    """
+
+    def __init__(self, sio, event='ipc_response', buffer_size=cfg.CLIENT_BUFFER_SIZE, policy=cfg.BUFFER_POLICY,
+                 batch_window_ms=cfg.BATCH_WINDOW_MS, batch_max=cfg.BATCH_MAX_MESSAGES, delta=None,
+                 tracer=None, socket_backlog=cfg.CLIENT_SOCKET_BACKLOG):
+        if policy not in POLICIES:
+            raise ValueError("Unknown buffer policy {}, expected one of {}".format(policy, POLICIES))
+        self.sio = sio
+        self.event = event
+        self.buffer_size = buffer_size
+        self.socket_backlog = socket_backlog
+        self.policy = policy
+        self.batch_window = batch_window_ms / 1000.0
+        self.batch_max = batch_max
+        # DeltaEncoder shared by the clients that asked for delta frames
+        self.delta = delta
+        self.delta_states = {}
+        # sid -> binary encoding negotiated by the client, JSON otherwise
+        self.encodings = {}
+        # LatencyTracer told about every frame handed to Socket.IO
+        self.tracer = tracer
+        self.clients = {}
+        self.senders = {}
+        # topic filter -> sids watching it, and the other way round
+        self.rooms = {}
+        self.topics = {}
+        # clients that overflowed, waiting for their disconnect handler
+        self.closing = set()
+        # sid -> direct emits scheduled but not queued on the socket yet
+        self.emitting = collections.Counter()
+        # counters of clients that already left
+        self.dropped = 0
+        self.conflated = 0
+
+    def add(self, sid, topics, snapshot=(), delta=False, encoding=None):
+        """Register a client watching ``topics``, ``snapshot`` holds the
+        frames it gets first, as one batch, before any live frame. With
+        ``delta`` the client gets patches against the frames it acknowledged,
+        with ``encoding`` (see serializer.negotiate) binary frames."""
+        if sid in self.clients:
+            self.watch(sid, topics, snapshot)
+            return
+        buffer = ClientBuffer(self.buffer_size, self.policy)
+        self.clients[sid] = buffer
+        self.topics[sid] = set()
+        if delta and self.delta is not None:
+            self.delta_states[sid] = DeltaState()
+        if encoding is not None:
+            self.encodings[sid] = encoding
+            snapshot = [self._binary(frame, encoding) for frame in snapshot]
+        self.watch(sid, topics)
+        send = self._send_batches if self.batch_window > 0 else self._send
+        self.senders[sid] = self.sio.start_background_task(send, sid, buffer, list(snapshot))
+        logger.info("Client {} added to broadcaster - {} clients".format(sid, len(self.clients)))
+
+    def watch(self, sid, topics, snapshot=()):
+        buffer = self.clients[sid]
+        encoding = self.encodings.get(sid)
+        for frame in snapshot:
+            # flagged so the tracer does not take the cached frame for a live one
+            frame = dict(frame, replay=True)
+            buffer.put(frame if encoding is None else self._binary(frame, encoding))
+        for topic in topics:
+            if topic in self.topics[sid]:
+                continue
+            self.topics[sid].add(topic)
+            self.rooms.setdefault(topic, set()).add(sid)
+
+    def unwatch(self, sid, topics):
+        """Stop sending ``topics`` to a client, returns the topics nobody
+        watches anymore."""
+        unwatched = []
+        for topic in topics:
+            if topic not in self.topics.get(sid, ()):
+                continue
+            self.topics[sid].discard(topic)
+            room = self.rooms[topic]
+            room.discard(sid)
+            if not room:
+                del self.rooms[topic]
+                unwatched.append(topic)
+        return unwatched
+
+    def remove(self, sid):
+        """Forget a client, returns the topics nobody watches anymore."""
+        unwatched = self.unwatch(sid, list(self.topics.get(sid, ())))
+        self.topics.pop(sid, None)
+        self.closing.discard(sid)
+        self.emitting.pop(sid, None)
+        self.delta_states.pop(sid, None)
+        self.encodings.pop(sid, None)
+        buffer = self.clients.pop(sid, None)
+        sender = self.senders.pop(sid, None)
+        if sender is not None:
+            sender.cancel()
+        if buffer is not None:
+            self.dropped += buffer.dropped
+            self.conflated += buffer.conflated
+            logger.info("Client {} removed from broadcaster - dropped {} conflated {} - {} clients".format(
+                sid, buffer.dropped, buffer.conflated, len(self.clients)))
+        return unwatched
+
+    def publish(self, topic_filter, message, frame=None):
+        """Queue a message received through the ``topic_filter`` subscription
+        for every client watching a filter that matches its topic, once per
+        client however many of its filters match. Overlapping subscriptions
+        each receive the message, only one copy must be published."""
+        # encoded once, every client buffer holds the same frame
+        if frame is None:
+            frame = {'data': serializer.encode(message), 'topic': topic_filter}
+        key = conflation_key(message) if self.policy == CONFLATE else None
+        if key is not None:
+            key = (frame.get('topic'),) + key
+        # and once per binary encoding some client of the room negotiated
+        binary = {}
+        # encoding -> idle clients sent the frame with one emit
+        direct = {}
+        topic = frame.get('topic') or topic_filter
+        sids = set()
+        for room_filter, room in self.rooms.items():
+            if topic_matches(room_filter, topic):
+                sids.update(room)
+        for sid in sids:
+            if sid in self.closing:
+                continue
+            out = frame
+            encoding = self.encodings.get(sid)
+            if encoding is not None:
+                out = binary.get(encoding)
+                if out is None:
+                    out = binary[encoding] = self._binary(frame, encoding, message)
+            if self._direct(sid):
+                direct.setdefault(encoding, []).append(sid)
+                self.emitting[sid] += 1
+                continue
+            if not self.clients[sid].put(out, key):
+                logger.info("Client {} overflowed its buffer of {} messages, disconnecting".format(sid, self.buffer_size))
+                # the disconnect handler removes it and releases its topics
+                self.closing.add(sid)
+                self.clients[sid].pending.clear()
+                self.sio.start_background_task(self.sio.disconnect, sid)
+        for encoding, sids in direct.items():
+            self.sio.start_background_task(self._emit_direct, sids, binary[encoding] if encoding else frame)
+
+    def _direct(self, sid):
+        # batching and delta clients get frames built for them by their sender,
+        # a backlogged client gets its frames through its buffer and its policy
+        return (self.batch_window <= 0 and sid not in self.delta_states and self.clients[sid].idle()
+                and self.backlog(sid) + self.emitting[sid] < self.socket_backlog)
+
+    async def _emit_direct(self, sids, frame):
+        # every sid is a room of its own, the packet is encoded once for the list
+        try:
+            started = time.perf_counter()
+            await self.sio.emit(self.event, frame, to=sids)
+            metrics.EMIT_SECONDS.observe(time.perf_counter() - started)
+            metrics.EMITS.inc()
+            metrics.FRAMES_EMITTED.inc(len(sids))
+            if self.tracer is not None:
+                for sid in sids:
+                    self.tracer.emitted(sid, (frame,))
+        except Exception as e:
+            metrics.EMIT_ERRORS.inc()
+            logger.info("Failed to emit to {} clients - {}".format(len(sids), e))
+        finally:
+            for sid in sids:
+                if self.emitting[sid] > 1:
+                    self.emitting[sid] -= 1
+                else:
+                    self.emitting.pop(sid, None)
+
+    def _socket(self, sid):
+        eio_sid = self.sio.manager.eio_sid_from_sid(sid, '/')
+        return self.sio.eio.sockets.get(eio_sid) if eio_sid is not None else None
+
+    def backlog(self, sid):
+        """Packets queued for the client that its engine.io writer has not
+        taken yet."""
+        socket = self._socket(sid)
+        return socket.queue.qsize() if socket is not None else 0
+
+    async def _drained(self, sid):
+        # the writer calls task_done() for every packet it takes, join()
+        # returns once it took them all, however slowly the client reads
+        socket = self._socket(sid)
+        if socket is not None and socket.queue.qsize() >= self.socket_backlog:
+            await socket.queue.join()
+
+    def ack(self, sid, topic, seq):
+        state = self.delta_states.get(sid)
+        if state is not None:
+            state.ack(topic, seq)
+
+    def resync(self, sid, topic):
+        """Send the next frame of ``topic`` in full, the client lost its base."""
+        state = self.delta_states.get(sid)
+        if state is not None:
+            state.resync(topic)
+
+    @staticmethod
+    def _binary(frame, encoding, message=None):
+        if message is None:
+            message = serializer.decode(frame['data'])
+        binary = dict(frame)
+        binary['data'] = serializer.encode_binary(message, encoding)
+        binary['encoding'] = encoding
+        return binary
+
+    def stats(self):
+        return {
+            'clients': len(self.clients),
+            'topics': len(self.rooms),
+            'dropped': self.dropped + sum(b.dropped for b in self.clients.values()),
+            'conflated': self.conflated + sum(b.conflated for b in self.clients.values()),
+        }
+
+    def _emitted(self, sid, frames, started, live=True):
+        metrics.EMIT_SECONDS.observe(time.perf_counter() - started)
+        metrics.EMITS.inc()
+        metrics.FRAMES_EMITTED.inc(len(frames))
+        # last values and history replays are as old as the cached frame,
+        # they would skew the latency of live deliveries
+        if self.tracer is not None and live:
+            self.tracer.emitted(sid, [frame for frame in frames if not frame.get('replay')])
+
+    def _prepare(self, sid, frame):
+        state = self.delta_states.get(sid)
+        if state is None:
+            return frame
+        return self.delta.encode(state, frame)
+
+    async def _emit_batch(self, sid, batch, live=True):
+        frames = [self._prepare(sid, frame) for frame in batch]
+        payload = {
+            'data': [frame.get('data') for frame in frames],
+            'seq': [frame.get('seq') for frame in frames],
+            'topic': [frame.get('topic') for frame in frames],
+            # frames of one history share its epoch
+            'epoch': frames[0].get('epoch') if frames else None,
+        }
+        if any('patch' in frame for frame in frames):
+            payload['patch'] = [frame.get('patch') for frame in frames]
+            payload['base'] = [frame.get('base') for frame in frames]
+        if sid in self.encodings:
+            payload['encoding'] = [frame.get('encoding') for frame in frames]
+        try:
+            started = time.perf_counter()
+            await self.sio.emit(self.event + '_batch', payload, room=sid)
+            self._emitted(sid, batch, started, live)
+        except Exception as e:
+            metrics.EMIT_ERRORS.inc()
+            logger.info("Failed to emit batch to client {} - {}".format(sid, e))
+
+    async def _send(self, sid, buffer, snapshot):
+        if snapshot:
+            await self._emit_batch(sid, snapshot, live=False)
+        while True:
+            # frames stay in the buffer, under its policy, until the socket takes more
+            await buffer.wait()
+            await self._drained(sid)
+            frames = buffer.drain(max(1, self.socket_backlog - self.backlog(sid)))
+            # each sio.emit() sends from a task of its own and waits for it,
+            # started together they reach the socket in order within one loop pass
+            started = time.perf_counter()
+            results = await asyncio.gather(
+                *[self.sio.emit(self.event, self._prepare(sid, frame), room=sid) for frame in frames],
+                return_exceptions=True)
+            for frame, result in zip(frames, results):
+                if isinstance(result, Exception):
+                    metrics.EMIT_ERRORS.inc()
+                    logger.info("Failed to emit to client {} - {}".format(sid, result))
+                else:
+                    self._emitted(sid, (frame,), started)
+
+    async def _send_batches(self, sid, buffer, snapshot):
+        # the first message opens a window, everything arriving before it
+        # closes (or until batch_max is reached) goes out in the same frame
+        if snapshot:
+            await self._emit_batch(sid, snapshot, live=False)
+        loop = asyncio.get_running_loop()
+        while True:
+            await buffer.wait()
+            await self._drained(sid)
+            batch = buffer.drain(1)
+            if not batch:
+                continue
+            deadline = loop.time() + self.batch_window
+            while True:
+                batch.extend(buffer.drain(self.batch_max - len(batch)))
+                remaining = deadline - loop.time()
+                if len(batch) >= self.batch_max or remaining <= 0:
+                    break
+                buffer.ready.clear()
+                try:
+                    await asyncio.wait_for(buffer.ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            await self._emit_batch(sid, batch)
@@ -0,0 +1,140 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import collections
+import time
+import uuid
+from array import array
+import config as cfg
+from topics import matches_any
+
+
+class LastValueCache:
+    """Last frame seen per topic (and per machine/job when the message
+    carries one), kept encoded so a new client gets a snapshot without
+    waiting for the next publish.
+
+    The last key field is the job: a machine starting a new job replaces
+    the entry of its previous one. Entries not updated for ``max_age``
+    seconds are dropped, and the least recently updated ones beyond
+    ``max_entries``.
+    """
+
+    def __init__(self, key_fields=cfg.CACHE_KEY_FIELDS, max_entries=cfg.CACHE_MAX_ENTRIES,
+                 max_age=cfg.CACHE_MAX_SECONDS):
+        self.key_fields = key_fields
+        self.max_entries = max_entries
+        self.max_age = max_age
+        # key -> frame, least recently updated first
+        self.values = collections.OrderedDict()
+        self.updated = {}
+        # key without the job field -> key of the current job
+        self.jobs = {}
+
+    def key(self, topic, message):
+        if isinstance(message, dict):
+            return (topic,) + tuple(message.get(f) for f in self.key_fields)
+        return (topic,) + (None,) * len(self.key_fields)
+
+    def update(self, topic, message, frame, now=None):
+        now = time.time() if now is None else now
+        key = self.key(topic, message)
+        machine = key[:-1] if self.key_fields else key
+        previous = self.jobs.get(machine)
+        if previous is not None and previous != key:
+            self._drop(previous)
+        self.jobs[machine] = key
+        self.values[key] = frame
+        self.values.move_to_end(key)
+        self.updated[key] = now
+        self._evict(now)
+
+    def _drop(self, key):
+        self.values.pop(key, None)
+        self.updated.pop(key, None)
+        machine = key[:-1] if self.key_fields else key
+        if self.jobs.get(machine) == key:
+            del self.jobs[machine]
+
+    def _evict(self, now):
+        cutoff = now - self.max_age
+        while self.values:
+            key = next(iter(self.values))
+            if len(self.values) <= self.max_entries and self.updated[key] >= cutoff:
+                break
+            self._drop(key)
+
+    def snapshot(self, topics=None, now=None):
+        """Latest frames of the topics matching the ``topics`` filters."""
+        self._evict(time.time() if now is None else now)
+        frames = [frame for key, frame in self.values.items() if topics is None or matches_any(topics, key[0])]
+        return sorted(frames, key=lambda frame: frame['seq'])
+
+    def __len__(self):
+        return len(self.values)
+
+
+class MessageHistory:
+    """Fixed size ring buffer of the frames sent to clients.
+
+    Every frame gets a sequence number, clients that reconnect ask for what
+    they missed with the last sequence number (or timestamp) they saw.
+    Storage is allocated once, old frames are overwritten in place.
+
+    Sequence numbers start over when the component restarts, so frames also
+    carry ``epoch``, an id of the numbering, for clients to tell a restart
+    from a replay of frames they already saw.
+    """
+
+    def __init__(self, capacity=cfg.HISTORY_SIZE, max_age=cfg.HISTORY_SECONDS, epoch=None):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.epoch = epoch or uuid.uuid4().hex[:12]
+        self.seqs = array('q', [0]) * capacity
+        self.times = array('d', [0.0]) * capacity
+        self.frames = [None] * capacity
+        self.next_seq = 1
+
+    def append(self, data, topic, now=None, seq=None):
+        """Store an encoded message and return the frame sent to clients.
+        ``seq`` is given by worker processes, numbered by the shared ring."""
+        if seq is None:
+            seq = self.next_seq
+        self.next_seq = seq + 1
+        frame = {'data': data, 'seq': seq, 'topic': topic, 'epoch': self.epoch}
+        i = seq % self.capacity
+        self.seqs[i] = seq
+        self.times[i] = time.time() if now is None else now
+        self.frames[i] = frame
+        return frame
+
+    def knows(self, epoch):
+        """True if sequence numbers of ``epoch`` are the ones of this
+        history, clients that do not send the epoch are trusted."""
+        return epoch is None or epoch == self.epoch
+
+    def since_seq(self, seq, topics=None, now=None):
+        """Frames newer than ``seq``, oldest first, of the topics matching
+        the ``topics`` filters."""
+        oldest = max(1, self.next_seq - self.capacity)
+        return self._collect(max(seq + 1, oldest), topics, now)
+
+    def since_time(self, timestamp, topics=None, now=None):
+        """Frames stored at or after ``timestamp``, oldest first."""
+        start = self.next_seq
+        oldest = max(1, self.next_seq - self.capacity)
+        while start > oldest and self.times[(start - 1) % self.capacity] >= timestamp:
+            start -= 1
+        return self._collect(start, topics, now)
+
+    def _collect(self, start, topics, now):
+        cutoff = (time.time() if now is None else now) - self.max_age
+        frames = []
+        for seq in range(start, self.next_seq):
+            i = seq % self.capacity
+            # sequence numbers from the shared ring can have gaps
+            if self.seqs[i] == seq and self.times[i] >= cutoff and (topics is None or matches_any(topics, self.frames[i]['topic'])):
+                frames.append(self.frames[i])
+        return frames
+
+    def __len__(self):
+        return min(self.next_seq - 1, self.capacity)
@@ -0,0 +1,121 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Settings for the websocket application.
+
+Every value can be overridden with an environment variable, which the
+component recipe sets through its ``Setenv`` section.
+"""
+
+import os
+
+# Size of the outbound buffer kept for every connected client
+CLIENT_BUFFER_SIZE = int(os.environ.get("WEBSOCKET_CLIENT_BUFFER_SIZE", "100"))
+# Packets Socket.IO may queue for a client's websocket writer before its
+# frames wait in the buffer above, where the buffer policy applies
+CLIENT_SOCKET_BACKLOG = int(os.environ.get("WEBSOCKET_CLIENT_SOCKET_BACKLOG", "8"))
+# What to do when a client's buffer is full: drop_oldest, conflate or disconnect
+BUFFER_POLICY = os.environ.get("WEBSOCKET_BUFFER_POLICY", "drop_oldest")
+# Top level message keys used to conflate pending messages for slow clients
+CONFLATE_KEYS = ("Operating Parameters", "Sensor Data")
+# Coalesce messages arriving within this window into one ipc_response_batch
+# frame per client, 0 disables batching
+BATCH_WINDOW_MS = float(os.environ.get("WEBSOCKET_BATCH_WINDOW_MS", "0"))
+# Upper bound of messages in one batch
+BATCH_MAX_MESSAGES = int(os.environ.get("WEBSOCKET_BATCH_MAX_MESSAGES", "50"))
+# Message fields identifying a machine or job, the last value cache keeps one
+# entry per topic and per combination of these fields
+CACHE_KEY_FIELDS = ("machine_id", "job_id")
+# Entries of the last value cache, and how long an entry not updated is kept
+CACHE_MAX_ENTRIES = int(os.environ.get("WEBSOCKET_CACHE_MAX_ENTRIES", "1000"))
+CACHE_MAX_SECONDS = float(os.environ.get("WEBSOCKET_CACHE_MAX_SECONDS", "3600"))
+# Number of messages kept in the replay history, and how old they may get
+HISTORY_SIZE = int(os.environ.get("WEBSOCKET_HISTORY_SIZE", "3600"))
+HISTORY_SECONDS = float(os.environ.get("WEBSOCKET_HISTORY_SECONDS", "600"))
+# IPC topics subscribed at startup and watched by clients that do not ask
+# for specific topics, comma separated, + and # wildcards are allowed
+DEFAULT_TOPICS = tuple(t.strip() for t in os.environ.get("WEBSOCKET_TOPICS", "runscreen/topic").split(",") if t.strip())
+# Topic filters clients may ask for, comma separated, a requested filter
+# must be covered by one of them (runscreen/# covers runscreen/+/status),
+# the default topics only when empty
+ALLOWED_TOPICS = tuple(t.strip() for t in os.environ.get("WEBSOCKET_ALLOWED_TOPICS", "").split(",")
+                       if t.strip()) or DEFAULT_TOPICS
+# Delta mode: a full frame every N frames, and how many recent messages are
+# kept to compute patches against
+DELTA_KEYFRAME_INTERVAL = int(os.environ.get("WEBSOCKET_DELTA_KEYFRAME_INTERVAL", "30"))
+DELTA_CAPACITY = int(os.environ.get("WEBSOCKET_DELTA_CAPACITY", "256"))
+# Sensor Data fields kept in rolling windows for aggregates and trend charts,
+# and how many samples each window holds (an hour at 10 samples a second)
+AGGREGATE_FIELDS = ("power_curve", "lv_activepower", "wind_speed", "wind_direction")
+AGGREGATE_CAPACITY = int(os.environ.get("WEBSOCKET_AGGREGATE_CAPACITY", "36000"))
+# Windows are allocated as they fill, and dropped once their topic sent
+# nothing for this many seconds
+AGGREGATE_IDLE_SECONDS = float(os.environ.get("WEBSOCKET_AGGREGATE_IDLE_SECONDS", "3600"))
+# Application log, written by a background thread (WEBSOCKET_LOG_ASYNC=0 writes
+# from the logging thread) and flushed every N records or N seconds
+LOG_FILE = os.environ.get("WEBSOCKET_LOG_FILE", "codeOutput/logs/websocket_app.log")
+LOG_ASYNC = os.environ.get("WEBSOCKET_LOG_ASYNC", "1") == "1"
+LOG_FLUSH_RECORDS = int(os.environ.get("WEBSOCKET_LOG_FLUSH_RECORDS", "100"))
+LOG_FLUSH_SECONDS = float(os.environ.get("WEBSOCKET_LOG_FLUSH_SECONDS", "1"))
+# Per message log lines allowed per second and per line, 0 logs every message
+HOTPATH_LOG_RATE = float(os.environ.get("WEBSOCKET_HOTPATH_LOG_RATE", "1"))
+# Rotating file receiving every raw IPC message, empty disables it
+AUDIT_LOG = os.environ.get("WEBSOCKET_AUDIT_LOG", "")
+AUDIT_LOG_MAX_BYTES = int(os.environ.get("WEBSOCKET_AUDIT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+AUDIT_LOG_BACKUPS = int(os.environ.get("WEBSOCKET_AUDIT_LOG_BACKUPS", "3"))
+# How often the event loop lag is sampled, in seconds
+LOOP_LAG_INTERVAL = float(os.environ.get("WEBSOCKET_LOOP_LAG_INTERVAL", "0.5"))
+# Delay before an IPC subscription whose stream closed is opened again
+IPC_RESUBSCRIBE_SECONDS = float(os.environ.get("WEBSOCKET_IPC_RESUBSCRIBE_SECONDS", "5"))
+# The loop watchdog logs the stack of anything blocking the event loop longer than this
+SLOW_CALLBACK_SECONDS = float(os.environ.get("WEBSOCKET_SLOW_CALLBACK_SECONDS", "0.1"))
+# Page served on /, and the directory of a built edgeui (yarn build) served
+# from memory as well, in which case its index.html is served on / and the
+# page above on /app.html
+UI_FILE = os.environ.get("WEBSOCKET_UI_FILE", "/tmp/app.html")
+UI_DIR = os.environ.get("WEBSOCKET_UI_DIR", "")
+# How often a served file is checked for changes on disk, in seconds
+STATIC_CHECK_SECONDS = float(os.environ.get("WEBSOCKET_STATIC_CHECK_SECONDS", "2"))
+# Message sections whose string formatted numbers are sent as floats to the
+# clients using a binary encoding (CBOR or MessagePack)
+NUMERIC_SECTIONS = ("Sensor Data",)
+# Engine.IO transports, websocket only skips the long polling handshake and
+# upgrade, "polling,websocket" lets clients behind proxies fall back
+TRANSPORTS = tuple(t.strip() for t in os.environ.get("WEBSOCKET_TRANSPORTS", "websocket").split(",") if t.strip())
+# Heartbeat in seconds, a client that stops answering is dropped after
+# PING_INTERVAL + PING_TIMEOUT and its buffer freed
+PING_INTERVAL = float(os.environ.get("WEBSOCKET_PING_INTERVAL", "10"))
+PING_TIMEOUT = float(os.environ.get("WEBSOCKET_PING_TIMEOUT", "10"))
+# permessage-deflate, for frames of at least COMPRESSION_THRESHOLD bytes
+COMPRESSION = os.environ.get("WEBSOCKET_COMPRESSION", "1") == "1"
+COMPRESSION_THRESHOLD = int(os.environ.get("WEBSOCKET_COMPRESSION_THRESHOLD", "1024"))
+# Log every Socket.IO and Engine.IO packet
+ENGINE_LOGGING = os.environ.get("WEBSOCKET_ENGINE_LOGGING", "0") == "1"
+# Worker processes serving the clients on the same port, above 1 the IPC
+# subscriptions move to a parent process sharing the messages through a
+# ring buffer in shared memory of RING_SLOTS slots of RING_SLOT_BYTES
+WORKERS = int(os.environ.get("WEBSOCKET_WORKERS", "1"))
+RING_SLOTS = int(os.environ.get("WEBSOCKET_RING_SLOTS", "2048"))
+RING_SLOT_BYTES = int(os.environ.get("WEBSOCKET_RING_SLOT_BYTES", "8192"))
+if WORKERS > 1 and "polling" in TRANSPORTS:
+    # the requests of a long polling session must all reach the worker holding
+    # it, the shared port hands each of them to any worker
+    raise ValueError("WEBSOCKET_TRANSPORTS {} includes polling, which needs WEBSOCKET_WORKERS=1, got {}".format(
+        ",".join(TRANSPORTS), WORKERS))
+# Set by the parent process in the environment of each worker
+WORKER_INDEX = int(os.environ.get("WEBSOCKET_WORKER_INDEX", "0"))
+# Delay before an exited worker is started again, doubled for every exit in
+# a row within a minute of its start, and how many such exits are tolerated
+WORKER_RESTART_SECONDS = float(os.environ.get("WEBSOCKET_WORKER_RESTART_SECONDS", "1"))
+WORKER_MAX_RESTARTS = int(os.environ.get("WEBSOCKET_WORKER_MAX_RESTARTS", "5"))
+if WORKER_INDEX:
+    # one log file per worker
+    LOG_FILE = "{0[0]}.worker{1}{0[1]}".format(os.path.splitext(LOG_FILE), WORKER_INDEX)
+# IPC pub/sub: greengrass, local for the localipc.py broker listening on
+# IPC_SOCKET, or memory for a broker inside the process, see localipc.py
+IPC = os.environ.get("WEBSOCKET_IPC", "greengrass")
+IPC_SOCKET = os.environ.get("WEBSOCKET_IPC_SOCKET", "/tmp/localipc.sock")
+# HTTP port of the Socket.IO server
+PORT = int(os.environ.get("WEBSOCKET_PORT", "8080"))
+# In multi process mode a scrape of /metrics on PORT reaches any one worker,
+# so each worker also serves its own /metrics on METRICS_PORT + index - 1
+METRICS_PORT = int(os.environ.get("WEBSOCKET_METRICS_PORT", "8081"))
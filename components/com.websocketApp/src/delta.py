@@ -0,0 +1,89 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Delta encoding of the frames sent to clients that opted in.
+
+A client first gets a full frame (keyframe), then JSON patches (RFC 6902
+replace/add/remove operations) against the last frame it acknowledged.
+Every ``keyframe_interval`` frames, or whenever the acknowledged frame is
+no longer known, a full frame is sent again.
+"""
+import collections
+import config as cfg
+import serializer
+
+
+def _escape(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def diff(old, new, path=''):
+    """JSON patch operations turning ``old`` into ``new``."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': path + '/' + _escape(key)})
+        for key, value in new.items():
+            child = path + '/' + _escape(key)
+            if key not in old:
+                ops.append({'op': 'add', 'path': child, 'value': value})
+            elif old[key] != value:
+                ops.extend(diff(old[key], value, child))
+        return ops
+    if old == new:
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+class DeltaState:
+    """What a delta client acknowledged, per topic."""
+
+    def __init__(self):
+        self.acked = {}
+        self.since_keyframe = {}
+
+    def ack(self, topic, seq):
+        if seq > self.acked.get(topic, 0):
+            self.acked[topic] = seq
+
+    def resync(self, topic):
+        self.acked.pop(topic, None)
+
+
+class DeltaEncoder:
+    """Keeps the recent messages and the patches between them, so clients
+    that acknowledged the same frame share one encoded patch."""
+
+    def __init__(self, keyframe_interval=cfg.DELTA_KEYFRAME_INTERVAL, capacity=cfg.DELTA_CAPACITY):
+        self.keyframe_interval = keyframe_interval
+        self.capacity = capacity
+        self.messages = collections.OrderedDict()
+        self.patches = collections.OrderedDict()
+        self.keyframes = 0
+        self.deltas = 0
+
+    def remember(self, frame, message):
+        self.messages[frame['seq']] = message
+        while len(self.messages) > self.capacity:
+            self.messages.popitem(last=False)
+
+    def encode(self, state, frame):
+        """The frame to send to a client in ``state``, a patch when possible."""
+        seq = frame.get('seq')
+        topic = frame.get('topic')
+        base = state.acked.get(topic)
+        count = state.since_keyframe.get(topic, 0)
+        if (seq is None or base is None or base >= seq or count >= self.keyframe_interval
+                or base not in self.messages or seq not in self.messages):
+            state.since_keyframe[topic] = 0
+            self.keyframes += 1
+            return frame
+        patch = self.patches.get((base, seq))
+        if patch is None:
+            patch = serializer.encode(diff(self.messages[base], self.messages[seq]))
+            self.patches[(base, seq)] = patch
+            while len(self.patches) > self.capacity:
+                self.patches.popitem(last=False)
+        state.since_keyframe[topic] = count + 1
+        self.deltas += 1
+        return {'patch': patch, 'base': base, 'seq': seq, 'topic': topic, 'epoch': frame.get('epoch')}
@@ -0,0 +1,330 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Pluggable IPC pub/sub transport, to run the components off a Greengrass
+nucleus for tests, benchmarks and local development.
+
+``connect(transport, path)`` returns a client with the part of
+GreengrassCoreIPCClient the components use, ``new_subscribe_to_topic`` and
+``new_publish_to_topic``, with the request, stream handler and message
+classes of awsiot.greengrasscoreipc.model:
+
+- ``greengrass``: the nucleus, awsiot.greengrasscoreipc.connect()
+- ``local``: a Broker listening on the Unix socket ``path``, frames are 4
+  byte big endian lengths followed by JSON
+- ``memory``: a broker inside the process, for tests and benchmarks
+  running publisher and subscriber in one process
+
+Stream handlers are called from a thread other than the caller's in every
+case, like with the nucleus. Run a broker with
+``python3 localipc.py --socket /tmp/localipc.sock``.
+
+This file and topics.py are shared by com.websocketApp and
+com.example.Publisher, keep the copies identical:
+com.websocketApp/src/tests/test_shared_modules.py fails when they differ.
+"""
+import argparse
+import asyncio
+import base64
+import concurrent.futures
+import itertools
+import json
+import logging
+import queue
+import socket
+import struct
+import threading
+from awsiot.greengrasscoreipc.model import (
+    BinaryMessage,
+    JsonMessage,
+    MessageContext,
+    SubscriptionResponseMessage,
+)
+from topics import topic_matches
+
+logger = logging.getLogger()
+
+LENGTH = struct.Struct('>I')
+
+
+def _frame(message):
+    data = json.dumps(message, separators=(',', ':')).encode()
+    return LENGTH.pack(len(data)) + data
+
+
+#### broker
+
+class Broker:
+    """Delivers every published message to the subscriptions whose topic
+    filter matches it, + and # wildcards included."""
+
+    def __init__(self):
+        # (writer, subscription id) -> topic filter
+        self.subscriptions = {}
+        self.published = 0
+        self.writers = set()
+        self.server = None
+
+    async def serve(self, path):
+        self.server = await asyncio.start_unix_server(self._client, path=path)
+        return self.server
+
+    async def close(self):
+        self.server.close()
+        # lets the connection tasks end on their own
+        for writer in list(self.writers):
+            writer.close()
+        while self.writers:
+            await asyncio.sleep(0.01)
+
+    async def _client(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                length = LENGTH.unpack(await reader.readexactly(LENGTH.size))[0]
+                request = json.loads(await reader.readexactly(length))
+                self._handle(writer, request)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for key in [key for key in self.subscriptions if key[0] is writer]:
+                del self.subscriptions[key]
+            writer.close()
+            self.writers.discard(writer)
+
+    def _handle(self, writer, request):
+        op = request['op']
+        if op == 'subscribe':
+            self.subscriptions[(writer, request['id'])] = request['topic']
+        elif op == 'unsubscribe':
+            self.subscriptions.pop((writer, request['id']), None)
+        elif op == 'publish':
+            self.published += 1
+            topic = request['topic']
+            for (subscriber, sub_id), topic_filter in list(self.subscriptions.items()):
+                if topic_matches(topic_filter, topic):
+                    message = dict(request, op='message', id=sub_id)
+                    subscriber.write(_frame(message))
+        writer.write(_frame({'op': 'response', 'id': request['id']}))
+
+
+#### clients
+
+class _Operation:
+
+    def __init__(self, client):
+        self.client = client
+        self.id = next(client.ids)
+        self.response = None
+
+    def get_response(self):
+        return self.response
+
+
+class SubscribeToTopicOperation(_Operation):
+
+    def __init__(self, client, stream_handler):
+        super().__init__(client)
+        self.handler = stream_handler
+
+    def activate(self, request):
+        self.response = self.client.subscribe(self, request.topic)
+        return self.response
+
+    def close(self):
+        future = self.client.unsubscribe(self)
+        self.handler.on_stream_closed()
+        return future
+
+
+class PublishToTopicOperation(_Operation):
+
+    def activate(self, request):
+        self.response = self.client.publish(self, request.topic, request.publish_message)
+        return self.response
+
+    def close(self):
+        return _done()
+
+
+def _done():
+    future = concurrent.futures.Future()
+    future.set_result(None)
+    return future
+
+
+def _event(topic, json_message=None, binary_message=None):
+    context = MessageContext(topic=topic)
+    if binary_message is None:
+        return SubscriptionResponseMessage(json_message=JsonMessage(message=json_message, context=context))
+    return SubscriptionResponseMessage(binary_message=BinaryMessage(message=binary_message, context=context))
+
+
+class _Client:
+
+    def new_subscribe_to_topic(self, stream_handler):
+        return SubscribeToTopicOperation(self, stream_handler)
+
+    def new_publish_to_topic(self):
+        return PublishToTopicOperation(self)
+
+
+class LocalIPCClient(_Client):
+    """Client of a Broker, stream handlers are called from a reader thread
+    like the ones of the Greengrass IPC client."""
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.streams = {}
+        self.thread = threading.Thread(target=self._read, name='localipc-reader', daemon=True)
+        self.thread.start()
+
+    def subscribe(self, operation, topic):
+        self.streams[operation.id] = operation
+        return self.request({'op': 'subscribe', 'id': operation.id, 'topic': topic})
+
+    def unsubscribe(self, operation):
+        self.streams.pop(operation.id, None)
+        return self.request({'op': 'unsubscribe', 'id': operation.id})
+
+    def publish(self, operation, topic, message):
+        payload = {'op': 'publish', 'id': operation.id, 'topic': topic}
+        if message.json_message is not None:
+            payload['json'] = message.json_message.message
+        else:
+            payload['binary'] = base64.b64encode(message.binary_message.message).decode()
+        return self.request(payload)
+
+    def request(self, message):
+        future = concurrent.futures.Future()
+        self.pending[message['id']] = future
+        data = _frame(message)
+        with self.lock:
+            self.sock.sendall(data)
+        return future
+
+    def close(self):
+        self.sock.close()
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('broker closed the connection')
+            data += chunk
+        return data
+
+    def _read(self):
+        try:
+            while True:
+                message = json.loads(self._recv(LENGTH.unpack(self._recv(LENGTH.size))[0]))
+                if message['op'] == 'response':
+                    future = self.pending.pop(message['id'], None)
+                    if future is not None:
+                        future.set_result(None)
+                    continue
+                operation = self.streams.get(message['id'])
+                if operation is None:
+                    continue
+                if 'json' in message:
+                    event = _event(message['topic'], json_message=message['json'])
+                else:
+                    event = _event(message['topic'], binary_message=base64.b64decode(message['binary']))
+                try:
+                    operation.handler.on_stream_event(event)
+                except Exception as e:
+                    logger.error("Stream handler failed - {}".format(e))
+        except (ConnectionError, OSError) as e:
+            for operation in list(self.streams.values()):
+                operation.handler.on_stream_error(e)
+                operation.handler.on_stream_closed()
+            self.streams.clear()
+
+
+class MemoryBroker:
+    """Broker inside the process, a dispatcher thread delivers the messages
+    to the stream handlers."""
+
+    def __init__(self):
+        # (client, subscription id) -> (topic filter, operation)
+        self.subscriptions = {}
+        self.published = 0
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._dispatch, name='localipc-memory', daemon=True)
+        self.thread.start()
+
+    def publish(self, topic, json_message=None, binary_message=None):
+        self.published += 1
+        self.queue.put(_event(topic, json_message, binary_message))
+
+    def _dispatch(self):
+        while True:
+            event = self.queue.get()
+            message = event.json_message or event.binary_message
+            for topic_filter, operation in list(self.subscriptions.values()):
+                if topic_matches(topic_filter, message.context.topic):
+                    try:
+                        operation.handler.on_stream_event(event)
+                    except Exception as e:
+                        logger.error("Stream handler failed - {}".format(e))
+
+
+class InProcessClient(_Client):
+    """Client of the MemoryBroker shared by the whole process."""
+
+    broker = None
+
+    def __init__(self):
+        if InProcessClient.broker is None:
+            InProcessClient.broker = MemoryBroker()
+        self.ids = itertools.count(1)
+
+    def subscribe(self, operation, topic):
+        self.broker.subscriptions[(self, operation.id)] = (topic, operation)
+        return _done()
+
+    def unsubscribe(self, operation):
+        self.broker.subscriptions.pop((self, operation.id), None)
+        return _done()
+
+    def publish(self, operation, topic, message):
+        if message.json_message is not None:
+            # a copy, like a message that went through the nucleus
+            self.broker.publish(topic, json_message=json.loads(json.dumps(message.json_message.message)))
+        else:
+            self.broker.publish(topic, binary_message=message.binary_message.message)
+        return _done()
+
+    def close(self):
+        for key in [key for key in self.broker.subscriptions if key[0] is self]:
+            del self.broker.subscriptions[key]
+
+
+def connect(transport='greengrass', path='/tmp/localipc.sock'):
+    """IPC client of ``transport``: greengrass, local or memory."""
+    if transport == 'greengrass':
+        import awsiot.greengrasscoreipc
+        return awsiot.greengrasscoreipc.connect()
+    if transport == 'local':
+        return LocalIPCClient(path)
+    if transport == 'memory':
+        return InProcessClient()
+    raise ValueError("Unknown IPC transport {}, expected greengrass, local or memory".format(transport))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--socket', default='/tmp/localipc.sock')
+    args = parser.parse_args()
+
+    async def main():
+        server = await Broker().serve(args.socket)
+        print("Local IPC broker listening on {}".format(args.socket))
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
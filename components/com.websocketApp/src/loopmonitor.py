@@ -0,0 +1,104 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Event loop health: scheduling lag, a watchdog thread that logs the stack
+of whatever blocks the loop, and per handler timings."""
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+import config as cfg
+import metrics
+
+logger = logging.getLogger()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a timer, anything blocking the
+    loop shows up as lag."""
+
+    def __init__(self, interval=cfg.LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            metrics.LOOP_LAG_SECONDS.observe(self.lag)
+
+
+class LoopWatchdog:
+    """Thread watching a heartbeat the event loop updates every
+    ``threshold / 2`` seconds. When the loop has been blocked longer than
+    ``threshold`` it logs the stack of the loop thread, which shows the
+    callback that is blocking it."""
+
+    def __init__(self, threshold=cfg.SLOW_CALLBACK_SECONDS):
+        self.threshold = threshold
+        # short enough to catch stalls just above the threshold
+        self.period = threshold / 2
+        self.loop = None
+        self.loop_thread = None
+        self.heartbeat = time.monotonic()
+        self.stalls = 0
+        self.last_stack = None
+
+    def start(self):
+        """Start watching, must be called from the event loop thread."""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self._beat()
+        thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        thread.start()
+
+    def _beat(self):
+        self.heartbeat = time.monotonic()
+        self.loop.call_later(self.period, self._beat)
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(self.period / 2)
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.period
+            # report every stall once, not on every check while it lasts
+            if blocked < self.threshold or reported == heartbeat:
+                continue
+            reported = heartbeat
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            self.stalls += 1
+            self.last_stack = ''.join(traceback.format_stack(frame))
+            metrics.LOOP_STALLS.inc()
+            logger.warning("Event loop blocked for more than {:.3f}s in:\n{}".format(blocked, self.last_stack))
+
+
+def timed(name):
+    """Record the duration of a handler in websocket_handler_seconds."""
+    def decorator(handler):
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await handler(*args, **kwargs)
+                finally:
+                    metrics.HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+        else:
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    metrics.HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+        return wrapper
+    return decorator
@@ -0,0 +1,150 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Minimal Prometheus metrics, rendered in the text exposition format.
+
+Counters and histograms are updated on the hot path, so they are plain
+attribute updates. Values that already live somewhere else (client
+buffers, queue sizes) are read through callbacks when /metrics is scraped.
+
+In multi process mode every worker counts on its own and /metrics on the
+shared port is answered by whichever worker accepts the connection, so
+each worker also serves /metrics on a port of its own (see
+config.METRICS_PORT) for the scraper to target, and each series is
+labelled with the worker index.
+"""
+import bisect
+import config as cfg
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# labels of every series of this process
+CONST_LABELS = (('worker', cfg.WORKER_INDEX),) if cfg.WORKER_INDEX else ()
+
+
+def _labels(labels):
+    labels = CONST_LABELS + tuple(labels)
+    if not labels:
+        return ''
+    pairs = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for k, v in labels)
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """Counter updated with ``inc()``, or read from ``collect()`` at scrape
+    time when the count is kept elsewhere."""
+
+    def __init__(self, name, documentation, collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        values = {(): self.collect()} if self.collect is not None else self.values
+        for key, value in (values.items() or [((), 0)]):
+            lines.append('{}{} {}'.format(self.name, _labels(key), value))
+        return lines
+
+
+class Gauge:
+    """Gauge read from ``collect()`` at scrape time, which returns a number
+    or a list of (labels dict, number)."""
+
+    def __init__(self, name, documentation, collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} gauge'.format(self.name)]
+        value = self.collect() if self.collect is not None else self.value
+        if isinstance(value, list):
+            for labels, v in value:
+                lines.append('{}{} {}'.format(self.name, _labels(sorted(labels.items())), v))
+        else:
+            lines.append('{}{} {}'.format(self.name, _labels(()), value))
+        return lines
+
+
+class Histogram:
+
+    DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts, sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        values = self.values or {(): [[0] * (len(self.buckets) + 1), 0.0, 0]}
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append('{}_bucket{} {}'.format(self.name, _labels(key + (('le', bound),)), cumulative))
+            lines.append('{}_bucket{} {}'.format(self.name, _labels(key + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{} {}'.format(self.name, _labels(key), total))
+            lines.append('{}_count{} {}'.format(self.name, _labels(key), count))
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+MESSAGES_RECEIVED = REGISTRY.register(Counter(
+    'websocket_messages_received_total', 'Messages received from the IPC subscriptions.'))
+FRAMES_EMITTED = REGISTRY.register(Counter(
+    'websocket_frames_emitted_total', 'Frames handed to Socket.IO, counted per message.'))
+EMITS = REGISTRY.register(Counter(
+    'websocket_emits_total', 'Socket.IO emits of runscreen frames, a batch counts once.'))
+EMIT_ERRORS = REGISTRY.register(Counter(
+    'websocket_emit_errors_total', 'Socket.IO emits that raised.'))
+EMIT_SECONDS = REGISTRY.register(Histogram(
+    'websocket_emit_seconds', 'Time spent in one Socket.IO emit of runscreen frames.'))
+IPC_STREAM_ERRORS = REGISTRY.register(Counter(
+    'websocket_ipc_stream_errors_total', 'Errors reported by the IPC subscription streams.'))
+IPC_RECONNECTS = REGISTRY.register(Counter(
+    'websocket_ipc_reconnects_total', 'IPC subscriptions opened again after their stream closed.'))
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    'websocket_event_loop_lag_seconds', 'Delay of the event loop in running a timer that was due.'))
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    'websocket_handler_seconds', 'Time spent in Socket.IO event and HTTP handlers.'))
+LOOP_STALLS = REGISTRY.register(Counter(
+    'websocket_event_loop_stalls_total', 'Times the event loop was blocked longer than the slow callback threshold.'))
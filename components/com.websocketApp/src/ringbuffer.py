@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Shared memory ring buffer carrying the IPC messages to the worker
+processes.
+
+A single process writes, every worker reads. Messages are written once,
+encoded, into fixed size slots; readers decode them straight from the shared
+memory. Each slot starts with the sequence number of the message it holds,
+so a reader that fell more than a ring behind sees its slots overwritten and
+skips ahead instead of reading a torn message.
+"""
+import struct
+from multiprocessing import shared_memory
+import config as cfg
+
+# sequence number of the last message written
+HEADER = struct.Struct('<Q')
+# sequence number, data length, monotonic receive time, topic filter length, topic length
+SLOT = struct.Struct('<QIdHH')
+
+
+class SharedRing:
+
+    def __init__(self, shm, slots, slot_size, owner=False):
+        self.shm = shm
+        self.buf = shm.buf
+        self.slots = slots
+        self.slot_size = slot_size
+        self.owner = owner
+
+    @classmethod
+    def create(cls, slots=cfg.RING_SLOTS, slot_size=cfg.RING_SLOT_BYTES):
+        shm = shared_memory.SharedMemory(create=True, size=HEADER.size + slots * slot_size)
+        shm.buf[:HEADER.size] = bytes(HEADER.size)
+        return cls(shm, slots, slot_size, owner=True)
+
+    @classmethod
+    def attach(cls, name, slots=cfg.RING_SLOTS, slot_size=cfg.RING_SLOT_BYTES):
+        return cls(shared_memory.SharedMemory(name=name), slots, slot_size)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def head(self):
+        return HEADER.unpack_from(self.buf, 0)[0]
+
+    def _offset(self, seq):
+        return HEADER.size + (seq % self.slots) * self.slot_size
+
+    def write(self, topic_filter, topic, data, received):
+        """Append an encoded message, returns its sequence number or None
+        when it does not fit in a slot."""
+        topic_filter = topic_filter.encode()
+        topic = topic.encode()
+        size = SLOT.size + len(topic_filter) + len(topic) + len(data)
+        if size > self.slot_size:
+            return None
+        seq = self.head() + 1
+        offset = self._offset(seq)
+        # the slot is marked empty while it is rewritten
+        SLOT.pack_into(self.buf, offset, 0, 0, 0.0, 0, 0)
+        start = offset + SLOT.size
+        for part in (topic_filter, topic, data):
+            self.buf[start:start + len(part)] = part
+            start += len(part)
+        SLOT.pack_into(self.buf, offset, seq, len(data), received, len(topic_filter), len(topic))
+        HEADER.pack_into(self.buf, 0, seq)
+        return seq
+
+    def read(self, seq):
+        """(topic filter, topic, data, received) of message ``seq``, or None
+        when its slot was overwritten. ``data`` is a view of the shared
+        memory, only valid until ``stale(seq)`` turns true."""
+        offset = self._offset(seq)
+        slot_seq, length, received, filter_length, topic_length = SLOT.unpack_from(self.buf, offset)
+        if slot_seq != seq:
+            return None
+        start = offset + SLOT.size
+        topic_filter = bytes(self.buf[start:start + filter_length]).decode()
+        start += filter_length
+        topic = bytes(self.buf[start:start + topic_length]).decode()
+        start += topic_length
+        return topic_filter, topic, self.buf[start:start + length], received
+
+    def stale(self, seq):
+        return HEADER.unpack_from(self.buf, self._offset(seq))[0] != seq
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RingReader:
+    """Position of one worker in a SharedRing, starting at its head."""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.next_seq = ring.head() + 1
+        self.lost = 0
+
+    def poll(self):
+        """Messages written since the last poll, as (seq, topic filter,
+        topic, data, received) with data decoded to a str."""
+        head = self.ring.head()
+        if head - self.next_seq + 1 > self.ring.slots:
+            skipped = head - self.ring.slots + 1
+            self.lost += skipped - self.next_seq
+            self.next_seq = skipped
+        messages = []
+        while self.next_seq <= head:
+            seq = self.next_seq
+            self.next_seq += 1
+            entry = self.ring.read(seq)
+            if entry is None:
+                self.lost += 1
+                continue
+            topic_filter, topic, view, received = entry
+            data = str(view, 'utf-8')
+            view.release()
+            if self.ring.stale(seq):
+                self.lost += 1
+                continue
+            messages.append((seq, topic_filter, topic, data, received))
+        return messages
@@ -0,0 +1,107 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Encoding of the messages sent to the browser.
+
+orjson or ujson are used when installed, the standard json module otherwise.
+Clients can negotiate a binary encoding instead, CBOR or MessagePack when
+cbor2 or msgpack are installed, in which the numeric sensor values are sent
+as floats.
+"""
+import json
+import config as cfg
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    def encode(message):
+        return orjson.dumps(message, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    decode = orjson.loads
+elif ujson is not None:
+    BACKEND = 'ujson'
+
+    def encode(message):
+        return ujson.dumps(message, ensure_ascii=False, default=str)
+
+    decode = ujson.loads
+else:
+    BACKEND = 'json'
+
+    def encode(message):
+        return json.dumps(message, separators=(',', ':'), ensure_ascii=False, default=str)
+
+    decode = json.loads
+
+# binary encodings available, by the name clients ask for
+BINARY_ENCODERS = {}
+if cbor2 is not None:
+    BINARY_ENCODERS['cbor'] = cbor2.dumps
+if msgpack is not None:
+    BINARY_ENCODERS['msgpack'] = lambda message: msgpack.packb(message, use_bin_type=True, default=str)
+
+
+def negotiate(requested):
+    """The first binary encoding of ``requested`` that is available, None
+    for JSON."""
+    if isinstance(requested, str):
+        requested = [requested]
+    for name in requested or ():
+        if name in BINARY_ENCODERS:
+            return name
+    return None
+
+
+def _number(value):
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def typed(message):
+    """Copy of ``message`` with the string formatted numbers of the
+    config.NUMERIC_SECTIONS sections turned into floats."""
+    if not isinstance(message, dict):
+        return message
+    message = dict(message)
+    for section in cfg.NUMERIC_SECTIONS:
+        values = message.get(section)
+        if isinstance(values, dict):
+            message[section] = {k: _number(v) for k, v in values.items()}
+    return message
+
+
+def encode_binary(message, encoding):
+    return BINARY_ENCODERS[encoding](typed(message))
+
+
+class SocketIOJson:
+    """Stand-in for the json module handed to socketio.AsyncServer, so the
+    Socket.IO packets themselves are encoded with the fast backend too."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return encode(obj)
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return decode(s)
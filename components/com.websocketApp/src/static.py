@@ -0,0 +1,147 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""In-memory static files for the UI.
+
+Files are read once, compressed once (gzip, and brotli when the module is
+installed) and served with ETags, so a reload costs a 304 or a memory copy
+instead of a disk read. A file that changes on disk is read again.
+"""
+import asyncio
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import time
+from aiohttp import web
+import config as cfg
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger()
+
+# not worth compressing, already compressed formats
+COMPRESSED_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'font/woff2', 'application/zip')
+
+
+class StaticAsset:
+
+    def __init__(self, path):
+        self.path = path
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.checked = 0.0
+        self.mtime = None
+        self.encodings = {}
+        self.etag = None
+
+    def load(self):
+        stat = os.stat(self.path)
+        with open(self.path, 'rb') as f:
+            body = f.read()
+        encodings = {'identity': body}
+        if self.content_type not in COMPRESSED_TYPES and len(body) > 256:
+            compressed = gzip.compress(body, 9)
+            if len(compressed) < len(body):
+                encodings['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body)
+                if len(compressed) < len(body):
+                    encodings['br'] = compressed
+        self.encodings = encodings
+        self.etag = '"{}"'.format(hashlib.sha1(body).hexdigest()[:20])
+        self.mtime = stat.st_mtime
+        self.checked = time.monotonic()
+
+    def stale(self):
+        """True when the file changed on disk, checked at most every
+        WEBSOCKET_STATIC_CHECK_SECONDS."""
+        now = time.monotonic()
+        if now - self.checked < cfg.STATIC_CHECK_SECONDS:
+            return False
+        self.checked = now
+        try:
+            return os.stat(self.path).st_mtime != self.mtime
+        except OSError:
+            return False
+
+
+class StaticFiles:
+    """Serves ``files`` (url path -> file) and, when ``root`` is set, every
+    file below it, falling back to its index.html for client side routes."""
+
+    def __init__(self, files=None, root=None):
+        self.files = dict(files or {})
+        self.root = os.path.abspath(root) if root else None
+        self.assets = {}
+
+    def preload(self):
+        for url, path in self.files.items():
+            self._load(url, path)
+        if self.root:
+            for directory, _, names in os.walk(self.root):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    self._load('/' + os.path.relpath(path, self.root).replace(os.sep, '/'), path)
+
+    def _load(self, url, path):
+        asset = StaticAsset(path)
+        try:
+            asset.load()
+        except OSError as e:
+            logger.info("Could not load static file {} - {}".format(path, e))
+            return None
+        self.assets[url] = asset
+        return asset
+
+    def _resolve(self, url):
+        if url in self.files:
+            return self.files[url]
+        if not self.root:
+            return None
+        path = os.path.abspath(os.path.join(self.root, url.lstrip('/')))
+        if path.startswith(self.root + os.sep) and os.path.isfile(path):
+            return path
+        return None
+
+    async def lookup(self, url):
+        if url == '/' and self.root and url not in self.files:
+            url = '/index.html'
+        asset = self.assets.get(url)
+        loop = asyncio.get_running_loop()
+        if asset is not None:
+            if asset.stale():
+                await loop.run_in_executor(None, asset.load)
+            return asset
+        path = self._resolve(url)
+        if path is not None:
+            return await loop.run_in_executor(None, self._load, url, path)
+        # client side route of the single page app
+        if self.root and '.' not in url.rsplit('/', 1)[-1]:
+            return self.assets.get('/index.html')
+        return None
+
+    async def handle(self, request):
+        asset = await self.lookup(request.path)
+        if asset is None:
+            raise web.HTTPNotFound()
+        headers = {
+            'ETag': asset.etag,
+            'Vary': 'Accept-Encoding',
+            # build output under /static/ has content hashes in the file names
+            'Cache-Control': 'public, max-age=31536000, immutable' if '/static/' in request.path else 'no-cache',
+        }
+        if asset.etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+        accepted = request.headers.get('Accept-Encoding', '')
+        encoding = 'identity'
+        for candidate in ('br', 'gzip'):
+            if candidate in asset.encodings and candidate in accepted:
+                encoding = candidate
+                break
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        headers['Content-Type'] = asset.content_type
+        return web.Response(body=asset.encodings[encoding], headers=headers)
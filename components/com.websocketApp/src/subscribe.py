@@ -1,5 +1,4 @@
 import queue
-import os
 import traceback
 import time
 import awsiot.greengrasscoreipc
@@ -17,53 +16,128 @@ from awscrt.io import (
 )
 from awsiot.eventstreamrpc import Connection, LifecycleHandler, MessageAmendment
 import logging
+from asynclog import hotpath, audit
+import config as cfg
+import metrics
+from topics import canonical_filter
 
-#logging.config.fileConfig(fname='config/log.conf', disable_existing_loggers=False)
-# Config the logger.
-filePath = "tmp"
-if not os.path.exists(filePath):
-    os.makedirs(filePath)    
-logging.basicConfig(filename="tmp/newfile.log",
-                    format='%(asctime)s %(message)s',
-                    filemode='a')
+# handlers are configured by app.py, see asynclog.setup_logging()
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
 
 TIMEOUT = 100
 
 class StreamHandler(client.SubscribeToTopicStreamHandler):
-    def __init__(self,lshq):
+    # on_stream_event runs on an IPC client thread, so messages are handed to the
+    # asyncio queue through the event loop instead of being put there directly.
+    # Queue items are (subscribed topic filter, actual topic, message, monotonic receive time,
+    # encoded message, sequence number), the last two are set by the worker processes only.
+    def __init__(self,lshq,loop,topic,on_closed=None):
         super().__init__()
         self.shq =  lshq
+        self.loop = loop
+        self.topic = topic
+        self.on_closed = on_closed
 
     def on_stream_event(self, event: SubscriptionResponseMessage) -> None:
-        logger.info("Message from IPC recevied at : {}".format(time.time()))
+        received = time.monotonic()
+        hotpath.info("Message from IPC recevied at : %s", time.time())
         try:
-            message_string = str(event.json_message.message)
-            with open('/tmp/websocket_Subscriber.log', 'a') as f:
-                print(message_string, file=f)
-            self.shq.put(message_string)
-            logger.debug("Message sent to queue at : {}".format(time.time()))
+            message = event.json_message.message
+            context = event.json_message.context
+            # the actual topic matters when subscribed with a wildcard
+            topic = context.topic if context is not None and context.topic else self.topic
+            # raw message audit trail, only written when WEBSOCKET_AUDIT_LOG is set
+            audit.info("%s", message)
+            self.loop.call_soon_threadsafe(self.shq.put_nowait, (self.topic, topic, message, received, None, None))
+            hotpath.debug("Message sent to queue at : %s", time.time())
         except Exception as e:
             logger.error("Exception - Failed during reading message from event - {}".format(e))          
             
     def on_stream_error(self, error: Exception) -> bool:
-        print("Stream error")
+        logger.error("Stream error on {} - {}".format(self.topic, error))
+        metrics.IPC_STREAM_ERRORS.inc()
         return True
 
     def on_stream_closed(self) -> None:
         logger.debug("Close the stream")
-        pass
+        if self.on_closed is not None:
+            self.loop.call_soon_threadsafe(self.on_closed)
 
 class MySubscriber:
-    def __init__(self, lq):
+    def __init__(self, lq, loop, on_closed=None):
         self.subq = lq
+        self.loop = loop
+        self.on_closed = on_closed
 
     def subscribe(self, ipc_client,topicname):
         request = SubscribeToTopicRequest()
         request.topic = topicname
-        handler = StreamHandler(self.subq)
+        handler = StreamHandler(self.subq,self.loop,topicname,self.on_closed)
         operation = ipc_client.new_subscribe_to_topic(handler)
         future = operation.activate(request)
         #future.result(TIMEOUT)
+        # keep the operation alive, it is shared by every connected client
+        self.operation = operation
+        return operation
+
+    def close(self):
+        self.operation.close()
+
+
+class TopicSubscriptions:
+    """One IPC subscription per topic filter, shared by every client watching it."""
+
+    def __init__(self, ipc_client, permanent=()):
+        self.ipc_client = ipc_client
+        # topics kept subscribed even without clients, so caches stay warm
+        self.permanent = set(permanent)
+        self.subscribers = {}
+        self.queue = None
+        self.loop = None
+
+    def start(self, lq, loop):
+        self.queue = lq
+        self.loop = loop
+        for topic in self.permanent:
+            self.subscribe(topic)
+
+    def subscribe(self, topic):
+        if topic in self.subscribers:
+            return
+        logger.info("Subscribing to {}".format(topic))
+        subscriber = MySubscriber(self.queue, self.loop)
+        subscriber.on_closed = lambda: self._closed(topic, subscriber)
+        subscriber.subscribe(self.ipc_client, topic)
+        self.subscribers[topic] = subscriber
+
+    def _closed(self, topic, subscriber):
+        # a stream we did not release ourselves closed, open it again
+        if self.subscribers.get(topic) is subscriber:
+            logger.info("Subscription to {} closed, subscribing again in {}s".format(topic, cfg.IPC_RESUBSCRIBE_SECONDS))
+            self.loop.call_later(cfg.IPC_RESUBSCRIBE_SECONDS, self._resubscribe, topic, subscriber)
+
+    def _resubscribe(self, topic, subscriber):
+        if self.subscribers.get(topic) is not subscriber:
+            return
+        del self.subscribers[topic]
+        try:
+            self.subscribe(topic)
+            metrics.IPC_RECONNECTS.inc(topic=topic)
+        except Exception as e:
+            logger.error("Failed to subscribe again to {} - {}".format(topic, e))
+            self.subscribers[topic] = subscriber
+            self.loop.call_later(cfg.IPC_RESUBSCRIBE_SECONDS, self._resubscribe, topic, subscriber)
+
+    def delivers(self, topic_filter, topic):
+        """False for the copies of a message received by the overlapping
+        subscriptions other than its canonical filter."""
+        return canonical_filter(self.subscribers, topic) == topic_filter
+
+    def release(self, topic):
+        if topic in self.permanent:
+            return
+        subscriber = self.subscribers.pop(topic, None)
+        if subscriber is not None:
+            logger.info("Unsubscribing from {}".format(topic))
+            subscriber.close()
 
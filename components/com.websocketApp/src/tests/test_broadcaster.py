@@ -0,0 +1,242 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import asyncio
+import types
+import pytest
+from broadcaster import Broadcaster, ClientBuffer, CONFLATE, DISCONNECT, DROP_OLDEST
+
+
+class FakeTask:
+
+    def cancel(self):
+        pass
+
+
+class FakeSio:
+    """Records what the broadcaster asks of Socket.IO, background tasks are
+    never run so the client buffers only fill."""
+
+    def __init__(self):
+        self.tasks = []
+        # sids are their own engine.io sids, sockets exist once connected
+        self.manager = types.SimpleNamespace(eio_sid_from_sid=lambda sid, namespace: sid)
+        self.eio = types.SimpleNamespace(sockets={})
+
+    def connect(self, sid):
+        self.eio.sockets[sid] = types.SimpleNamespace(queue=asyncio.Queue())
+
+    def start_background_task(self, target, *args):
+        self.tasks.append((target, args))
+        return FakeTask()
+
+    async def disconnect(self, sid):
+        pass
+
+    async def emit(self, event, data, to=None, room=None):
+        pass
+
+    def scheduled(self, name):
+        return [args for target, args in self.tasks if target.__name__ == name]
+
+
+class StalledSio(FakeSio):
+    """Runs the background tasks, emits queue the packets on engine.io
+    sockets whose writer never takes them, like a client that stopped
+    reading."""
+
+    def start_background_task(self, target, *args):
+        super().start_background_task(target, *args)
+        return asyncio.ensure_future(target(*args))
+
+    async def emit(self, event, data, to=None, room=None):
+        for sid in to or [room]:
+            self.eio.sockets[sid].queue.put_nowait((event, data))
+
+
+def test_unknown_policy_is_refused():
+    with pytest.raises(ValueError):
+        ClientBuffer(2, 'drop_newest')
+
+
+def test_drop_oldest_keeps_the_newest_messages():
+    buffer = ClientBuffer(2, DROP_OLDEST)
+    for n in range(4):
+        assert buffer.put(n)
+    assert buffer.drain(10) == [2, 3]
+    assert buffer.dropped == 2
+
+
+def test_conflate_replaces_a_pending_message_in_place():
+    buffer = ClientBuffer(3, CONFLATE)
+    buffer.put('a1', key='a')
+    buffer.put('b1', key='b')
+    buffer.put('a2', key='a')
+    assert buffer.drain(10) == ['a2', 'b1']
+    assert buffer.conflated == 1
+    assert buffer.dropped == 0
+
+
+def test_conflate_drops_the_oldest_of_different_keys():
+    buffer = ClientBuffer(2, CONFLATE)
+    for key in 'abc':
+        buffer.put(key, key=key)
+    assert buffer.drain(10) == ['b', 'c']
+    assert buffer.dropped == 1
+
+
+def test_disconnect_refuses_the_message_over_the_limit():
+    buffer = ClientBuffer(2, DISCONNECT)
+    assert buffer.put(1) and buffer.put(2)
+    assert not buffer.put(3)
+    assert buffer.drain(10) == [1, 2]
+
+
+def broadcaster(policy=DROP_OLDEST, buffer_size=2):
+    sio = FakeSio()
+    return sio, Broadcaster(sio, buffer_size=buffer_size, policy=policy, batch_window_ms=0)
+
+
+def test_publish_queues_the_frame_for_the_room():
+    sio, b = broadcaster()
+    b.add('s1', ['runscreen/#'])
+    b.add('s2', ['other/#'])
+    b.publish('runscreen/#', {'v': 1}, {'data': '{"v": 1}', 'topic': 'runscreen/a'})
+    assert b.clients['s1'].drain(10) == [{'data': '{"v": 1}', 'topic': 'runscreen/a'}]
+    assert len(b.clients['s2']) == 0
+
+
+def test_idle_clients_share_one_emit():
+    sio, b = broadcaster()
+    for sid in ('s1', 's2'):
+        b.add(sid, ['runscreen/#'])
+        b.clients[sid].waiting = True
+    b.publish('runscreen/#', {'v': 1})
+    [(sids, frame)] = sio.scheduled('_emit_direct')
+    assert sorted(sids) == ['s1', 's2']
+    assert len(b.clients['s1']) == 0
+
+
+def test_idle_client_with_a_socket_backlog_gets_the_frame_buffered():
+    sio, b = broadcaster()
+    b.socket_backlog = 2
+    for sid in ('s1', 's2'):
+        sio.connect(sid)
+        b.add(sid, ['runscreen/#'])
+        b.clients[sid].waiting = True
+    for n in range(2):
+        sio.eio.sockets['s2'].queue.put_nowait(n)
+    b.publish('runscreen/#', {'v': 1})
+    [(sids, frame)] = sio.scheduled('_emit_direct')
+    assert sids == ['s1']
+    assert len(b.clients['s2']) == 1
+
+
+def test_direct_emits_in_flight_count_as_backlog():
+    sio, b = broadcaster()
+    b.socket_backlog = 2
+    sio.connect('s1')
+    b.add('s1', ['runscreen/#'])
+    b.clients['s1'].waiting = True
+    # a burst published before any emit task ran
+    for n in range(4):
+        b.publish('runscreen/#', {'v': n})
+    assert len(sio.scheduled('_emit_direct')) == 2
+    assert len(b.clients['s1']) == 2
+
+
+def test_overlapping_filters_deliver_a_message_once():
+    sio, b = broadcaster(buffer_size=10)
+    b.add('s1', ['runscreen/#', 'runscreen/a'])
+    b.add('s2', ['runscreen/a'])
+    b.add('s3', ['runscreen/b'])
+    # only the canonical copy of the message is published
+    b.publish('runscreen/#', {}, {'data': '{}', 'topic': 'runscreen/a'})
+    assert len(b.clients['s1']) == 1
+    # the clients of the other matching filters get it too
+    assert len(b.clients['s2']) == 1
+    assert len(b.clients['s3']) == 0
+
+
+def test_overflow_disconnects_the_client_and_releases_its_topics():
+    sio, b = broadcaster(policy=DISCONNECT)
+    b.add('s1', ['runscreen/#'])
+    b.add('s2', ['runscreen/#', 'other/#'])
+    for n in range(3):
+        b.publish('runscreen/#', {'v': n})
+    assert sorted(sio.scheduled('disconnect')) == [('s1',), ('s2',)]
+    assert b.closing == {'s1', 's2'}
+    # the frames of a closing client are dropped, not queued
+    assert len(b.clients['s1']) == 0
+    b.publish('runscreen/#', {'v': 3})
+    assert len(b.clients['s1']) == 0
+    assert len(sio.scheduled('disconnect')) == 2
+    # the disconnect handler removes the clients
+    assert b.remove('s1') == []
+    assert sorted(b.remove('s2')) == ['other/#', 'runscreen/#']
+    assert b.closing == set()
+    assert b.rooms == {}
+    assert b.stats()['dropped'] == 2
+
+
+def test_snapshot_frames_are_flagged_as_replays():
+    sio, b = broadcaster(buffer_size=10)
+    b.add('s1', ['runscreen/#'])
+    b.watch('s1', [], snapshot=[{'data': '{}', 'topic': 'runscreen/a', 'seq': 1}])
+    assert b.clients['s1'].drain(10) == [{'data': '{}', 'topic': 'runscreen/a', 'seq': 1, 'replay': True}]
+
+
+def test_batch_sender_waits_for_a_stalled_socket():
+    async def stall():
+        sio = StalledSio()
+        b = Broadcaster(sio, buffer_size=5, policy=DROP_OLDEST, batch_window_ms=1, batch_max=2, socket_backlog=3)
+        sio.connect('s1')
+        b.add('s1', ['runscreen/#'])
+        for n in range(50):
+            b.publish('runscreen/#', {'v': n})
+            await asyncio.sleep(0.002)
+        queue = sio.eio.sockets['s1'].queue
+        batches = [queue.get_nowait()[1] for _ in range(queue.qsize())]
+        pending = len(b.clients['s1'])
+        b.remove('s1')
+        return batches, pending, b.stats()['dropped']
+
+    batches, pending, dropped = asyncio.run(stall())
+    # the sender stopped at the socket backlog, the rest went by the buffer policy
+    assert len(batches) == 3
+    assert pending == 5
+    assert dropped == 50 - pending - sum(len(batch['data']) for batch in batches)
+
+
+def test_sender_waits_for_a_stalled_socket():
+    async def stall():
+        sio = StalledSio()
+        b = Broadcaster(sio, buffer_size=5, policy=DROP_OLDEST, batch_window_ms=0, socket_backlog=3)
+        sio.connect('s1')
+        b.add('s1', ['runscreen/#'])
+        await asyncio.sleep(0)
+        for n in range(50):
+            b.publish('runscreen/#', {'v': n})
+            await asyncio.sleep(0)
+        frames = sio.eio.sockets['s1'].queue.qsize()
+        pending = len(b.clients['s1'])
+        b.remove('s1')
+        return frames, pending, b.stats()['dropped']
+
+    # the default path: no batching, frames emitted directly while the client keeps up
+    frames, pending, dropped = asyncio.run(stall())
+    assert (frames, pending, dropped) == (3, 5, 42)
+
+
+def test_stalled_client_is_disconnected_by_its_policy():
+    async def stall():
+        sio = StalledSio()
+        b = Broadcaster(sio, buffer_size=5, policy=DISCONNECT, batch_window_ms=0, socket_backlog=3)
+        sio.connect('s1')
+        b.add('s1', ['runscreen/#'])
+        await asyncio.sleep(0)
+        for n in range(50):
+            b.publish('runscreen/#', {'v': n})
+            await asyncio.sleep(0)
+        return sio.scheduled('disconnect'), b.closing
+
+    assert asyncio.run(stall()) == ([('s1',)], {'s1'})
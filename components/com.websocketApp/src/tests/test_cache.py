@@ -0,0 +1,58 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+from cache import MessageHistory
+
+
+def test_frames_carry_the_epoch_of_the_history():
+    history = MessageHistory(capacity=4, max_age=60, epoch='e1')
+    assert history.append('{}', 'runscreen/a', now=0.0) == {'data': '{}', 'seq': 1, 'topic': 'runscreen/a',
+                                                            'epoch': 'e1'}
+
+
+def test_every_history_has_its_own_epoch():
+    assert MessageHistory(capacity=4, max_age=60).epoch != MessageHistory(capacity=4, max_age=60).epoch
+
+
+def test_since_seq_returns_the_missed_frames():
+    history = MessageHistory(capacity=4, max_age=60, epoch='e1')
+    for n in range(1, 4):
+        history.append(str(n), 'runscreen/a', now=0.0)
+    assert [f['data'] for f in history.since_seq(1, now=0.0)] == ['2', '3']
+    assert history.since_seq(3, now=0.0) == []
+
+
+def test_since_seq_skips_overwritten_and_expired_frames():
+    history = MessageHistory(capacity=4, max_age=60, epoch='e1')
+    for n in range(1, 7):
+        history.append(str(n), 'runscreen/a', now=float(n * 20))
+    assert [f['seq'] for f in history.since_seq(0, now=121.0)] == [4, 5, 6]
+
+
+def test_since_seq_filters_the_topics():
+    history = MessageHistory(capacity=4, max_age=60, epoch='e1')
+    history.append('a', 'runscreen/a', now=0.0)
+    history.append('b', 'other/b', now=0.0)
+    assert [f['data'] for f in history.since_seq(0, ['runscreen/#'], now=0.0)] == ['a']
+
+
+def test_seq_of_a_previous_instance_is_not_trusted():
+    # the component restarted, its numbering starts over at 1
+    before = MessageHistory(capacity=8, max_age=60)
+    for n in range(5):
+        before.append('old', 'runscreen/a', now=0.0)
+    after = MessageHistory(capacity=8, max_age=60)
+    for n in range(7):
+        after.append('new', 'runscreen/a', now=0.0)
+    # a client that saw seq 5 before the restart would miss 6 and 7
+    assert not after.knows(before.epoch)
+    assert after.knows(after.epoch)
+    assert after.knows(None)
+
+
+def test_worker_histories_share_the_ring_numbering():
+    # workers set the epoch to the name of the ring that numbers the frames
+    first = MessageHistory(capacity=4, max_age=60, epoch='psm_ring')
+    second = MessageHistory(capacity=4, max_age=60, epoch='psm_ring')
+    frame = first.append('{}', 'runscreen/a', now=0.0, seq=9)
+    assert second.knows(frame['epoch'])
+    assert first.next_seq == 10
@@ -0,0 +1,24 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import os
+import subprocess
+import sys
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_config(**environ):
+    # config.py reads the environment once, at import
+    return subprocess.run([sys.executable, '-c', 'import config'], cwd=SRC, capture_output=True, text=True,
+                          env=dict(os.environ, **environ))
+
+
+def test_workers_refuse_long_polling():
+    result = load_config(WEBSOCKET_WORKERS='2', WEBSOCKET_TRANSPORTS='polling,websocket')
+    assert result.returncode != 0
+    assert 'ValueError' in result.stderr
+
+
+def test_workers_serve_websocket_only():
+    assert load_config(WEBSOCKET_WORKERS='2', WEBSOCKET_TRANSPORTS='websocket').returncode == 0
+    assert load_config(WEBSOCKET_WORKERS='1', WEBSOCKET_TRANSPORTS='polling,websocket').returncode == 0
@@ -0,0 +1,125 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import serializer
+from delta import diff, DeltaEncoder, DeltaState
+
+
+def apply(document, ops):
+    """Minimal RFC 6902 add/remove/replace, enough to check the patches."""
+    for op in ops:
+        keys = [k.replace('~1', '/').replace('~0', '~') for k in op['path'].split('/')[1:]]
+        if not keys:
+            document = op['value']
+            continue
+        parent = document
+        for key in keys[:-1]:
+            parent = parent[key]
+        if op['op'] == 'remove':
+            del parent[keys[-1]]
+        else:
+            parent[keys[-1]] = op['value']
+    return document
+
+
+def test_diff_of_equal_documents_is_empty():
+    assert diff({'a': 1, 'b': {'c': [1, 2]}}, {'a': 1, 'b': {'c': [1, 2]}}) == []
+
+
+def test_diff_add_remove_replace():
+    old = {'keep': 1, 'gone': 2, 'changed': 'x'}
+    new = {'keep': 1, 'changed': 'y', 'added': [1]}
+    assert diff(old, new) == [
+        {'op': 'remove', 'path': '/gone'},
+        {'op': 'replace', 'path': '/changed', 'value': 'y'},
+        {'op': 'add', 'path': '/added', 'value': [1]},
+    ]
+
+
+def test_diff_recurses_into_objects_only():
+    old = {'Sensor Data': {'Wind Speed': '5.1', 'Power': '300'}, 'list': [1, 2]}
+    new = {'Sensor Data': {'Wind Speed': '6.2', 'Power': '300'}, 'list': [1, 3]}
+    assert diff(old, new) == [
+        {'op': 'replace', 'path': '/Sensor Data/Wind Speed', 'value': '6.2'},
+        {'op': 'replace', 'path': '/list', 'value': [1, 3]},
+    ]
+
+
+def test_diff_escapes_the_path():
+    ops = diff({'a/b': 1, 'm~n': 1}, {'a/b': 2, 'm~n': 2})
+    assert [op['path'] for op in ops] == ['/a~1b', '/m~0n']
+    assert apply({'a/b': 1, 'm~n': 1}, ops) == {'a/b': 2, 'm~n': 2}
+
+
+def test_diff_of_a_changed_type_replaces_the_value():
+    assert diff({'a': 1}, [1]) == [{'op': 'replace', 'path': '', 'value': [1]}]
+
+
+def test_patch_turns_the_old_message_into_the_new_one():
+    old = {'Machine': 'm1', 'Sensor Data': {'a': '1', 'b': '2'}, 'Tool': 'ok'}
+    new = {'Machine': 'm1', 'Sensor Data': {'a': '1', 'c': '3'}, 'Status': 'stopped'}
+    assert apply(json.loads(json.dumps(old)), diff(old, new)) == new
+
+
+def frame(seq, topic='runscreen/a'):
+    return {'seq': seq, 'topic': topic, 'epoch': 'e1'}
+
+
+def test_first_frame_is_a_keyframe():
+    encoder = DeltaEncoder(keyframe_interval=10, capacity=10)
+    encoder.remember(frame(1), {'v': 1})
+    assert encoder.encode(DeltaState(), frame(1)) == frame(1)
+    assert encoder.keyframes == 1
+
+
+def test_patch_against_the_acknowledged_frame():
+    encoder = DeltaEncoder(keyframe_interval=10, capacity=10)
+    encoder.remember(frame(1), {'v': 1, 'w': 0})
+    encoder.remember(frame(2), {'v': 2, 'w': 0})
+    state = DeltaState()
+    state.ack('runscreen/a', 1)
+    sent = encoder.encode(state, frame(2))
+    assert sent == {'patch': serializer.encode([{'op': 'replace', 'path': '/v', 'value': 2}]),
+                    'base': 1, 'seq': 2, 'topic': 'runscreen/a', 'epoch': 'e1'}
+    assert encoder.deltas == 1
+
+
+def test_clients_acknowledging_the_same_frame_share_the_patch():
+    encoder = DeltaEncoder(keyframe_interval=10, capacity=10)
+    encoder.remember(frame(1), {'v': 1})
+    encoder.remember(frame(2), {'v': 2})
+    first, second = DeltaState(), DeltaState()
+    first.ack('runscreen/a', 1)
+    second.ack('runscreen/a', 1)
+    assert encoder.encode(first, frame(2))['patch'] is encoder.encode(second, frame(2))['patch']
+
+
+def test_keyframe_every_interval():
+    encoder = DeltaEncoder(keyframe_interval=2, capacity=10)
+    state = DeltaState()
+    for seq in range(1, 6):
+        encoder.remember(frame(seq), {'v': seq})
+    state.ack('runscreen/a', 1)
+    kinds = ['patch' in encoder.encode(state, frame(seq)) for seq in range(2, 6)]
+    assert kinds == [True, True, False, True]
+
+
+def test_keyframe_when_the_acknowledged_frame_is_forgotten():
+    encoder = DeltaEncoder(keyframe_interval=10, capacity=2)
+    for seq in range(1, 4):
+        encoder.remember(frame(seq), {'v': seq})
+    state = DeltaState()
+    state.ack('runscreen/a', 1)
+    assert encoder.encode(state, frame(3)) == frame(3)
+
+
+def test_ack_only_moves_forward_and_resync_forces_a_keyframe():
+    encoder = DeltaEncoder(keyframe_interval=10, capacity=10)
+    encoder.remember(frame(1), {'v': 1})
+    encoder.remember(frame(2), {'v': 2})
+    state = DeltaState()
+    state.ack('runscreen/a', 1)
+    state.ack('runscreen/a', 0)
+    assert state.acked == {'runscreen/a': 1}
+    state.resync('runscreen/a')
+    assert encoder.encode(state, frame(2)) == frame(2)
@@ -0,0 +1,24 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import metrics
+
+
+def samples(metric):
+    return [line for line in metric.render() if not line.startswith('#')]
+
+
+def test_every_series_of_a_worker_is_labelled(monkeypatch):
+    monkeypatch.setattr(metrics, 'CONST_LABELS', (('worker', 2),))
+    counter = metrics.Counter('c', 'doc')
+    counter.inc(topic='a')
+    assert samples(counter) == ['c{worker="2",topic="a"} 1']
+    assert samples(metrics.Gauge('g', 'doc', collect=lambda: 3)) == ['g{worker="2"} 3']
+    assert samples(metrics.Gauge('g', 'doc', collect=lambda: [({'topic': 'a'}, 1)])) == ['g{worker="2",topic="a"} 1']
+    histogram = metrics.Histogram('h', 'doc', buckets=(1,))
+    histogram.observe(0.5)
+    assert samples(histogram) == ['h_bucket{worker="2",le="1"} 1', 'h_bucket{worker="2",le="+Inf"} 1',
+                                  'h_sum{worker="2"} 0.5', 'h_count{worker="2"} 1']
+
+
+def test_single_process_series_have_no_worker_label():
+    assert samples(metrics.Gauge('g', 'doc', collect=lambda: 3)) == ['g 3']
@@ -0,0 +1,80 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import pytest
+from ringbuffer import SharedRing, RingReader, SLOT
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing.create(slots=4, slot_size=128)
+    try:
+        yield ring
+    finally:
+        ring.close()
+
+
+def test_poll_returns_the_messages_in_order(ring):
+    reader = RingReader(ring)
+    assert reader.poll() == []
+    ring.write('runscreen/#', 'runscreen/a', b'{"n": 1}', 1.5)
+    ring.write('runscreen/#', 'runscreen/b', b'{"n": 2}', 2.5)
+    assert reader.poll() == [(1, 'runscreen/#', 'runscreen/a', '{"n": 1}', 1.5),
+                             (2, 'runscreen/#', 'runscreen/b', '{"n": 2}', 2.5)]
+    assert reader.poll() == []
+    assert reader.lost == 0
+
+
+def test_reader_starts_at_the_head(ring):
+    ring.write('t', 't', b'old', 0.0)
+    reader = RingReader(ring)
+    ring.write('t', 't', b'new', 0.0)
+    assert [m[3] for m in reader.poll()] == ['new']
+
+
+def test_overtaken_reader_skips_ahead_and_counts_the_lost_messages(ring):
+    reader = RingReader(ring)
+    for n in range(1, 11):
+        ring.write('t', 't', str(n).encode(), 0.0)
+    messages = reader.poll()
+    # only the last ring of messages is still there
+    assert [m[0] for m in messages] == [7, 8, 9, 10]
+    assert [m[3] for m in messages] == ['7', '8', '9', '10']
+    assert reader.lost == 6
+
+
+def test_oversize_message_is_not_written(ring):
+    assert ring.write('t', 't', b'x' * (128 - SLOT.size - 1), 0.0) is None
+    assert ring.head() == 0
+    assert ring.write('t', 't', b'x' * (128 - SLOT.size - 2), 0.0) == 1
+
+
+def test_slot_being_rewritten_reads_as_lost(ring):
+    reader = RingReader(ring)
+    ring.write('t', 't', b'1', 0.0)
+    # the writer marks the slot empty before it copies the message in
+    SLOT.pack_into(ring.buf, ring._offset(1), 0, 0, 0.0, 0, 0)
+    assert ring.read(1) is None
+    assert reader.poll() == []
+    assert reader.lost == 1
+
+
+def test_message_overwritten_while_read_is_stale(ring):
+    ring.write('t', 't', b'1', 0.0)
+    topic_filter, topic, view, received = ring.read(1)
+    assert not ring.stale(1)
+    for n in range(ring.slots):
+        ring.write('t', 't', b'2', 0.0)
+    assert ring.stale(1)
+    assert ring.read(1) is None
+    view.release()
+
+
+def test_worker_attaches_by_name(ring):
+    ring.write('t', 'topic', b'data', 0.0)
+    other = SharedRing.attach(ring.name, slots=4, slot_size=128)
+    try:
+        topic_filter, topic, view, received = other.read(1)
+        assert (topic, bytes(view)) == ('topic', b'data')
+        view.release()
+    finally:
+        other.close()
@@ -0,0 +1,18 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""localipc.py and topics.py are deployed with both components, each
+component ships its own copy."""
+import os
+import pytest
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUBLISHER_SRC = os.path.join(SRC, '..', '..', 'com.example.Publisher', 'src')
+
+
+@pytest.mark.parametrize('name', ['localipc.py', 'topics.py'])
+def test_copies_are_identical(name):
+    with open(os.path.join(SRC, name), 'rb') as f:
+        ours = f.read()
+    with open(os.path.join(PUBLISHER_SRC, name), 'rb') as f:
+        theirs = f.read()
+    assert ours == theirs, "{} differs between com.websocketApp and com.example.Publisher".format(name)
@@ -0,0 +1,47 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import asyncio
+import localipc
+from subscribe import TopicSubscriptions
+
+
+async def received(q, count):
+    items = []
+    while len(items) < count:
+        items.append(await asyncio.wait_for(q.get(), 5))
+    return items
+
+
+def test_overlapping_subscriptions_deliver_each_message_once():
+    async def overlap():
+        ipc_client = localipc.connect('memory')
+        q = asyncio.Queue()
+        # the recipe defaults, and a client watching the whole tree
+        subscriptions = TopicSubscriptions(ipc_client, ['runscreen/topic'])
+        subscriptions.start(q, asyncio.get_running_loop())
+        subscriptions.subscribe('runscreen/#')
+        try:
+            for n in range(10):
+                ipc_client.broker.publish('runscreen/topic', json_message={'n': n})
+            ipc_client.broker.publish('runscreen/other', json_message={'n': 10})
+            # each subscription gets its copy of the runscreen/topic messages
+            items = await received(q, 21)
+            return [(topic_filter, message['n']) for topic_filter, topic, message, _, _, _ in items
+                    if subscriptions.delivers(topic_filter, topic)]
+        finally:
+            subscriptions.release('runscreen/#')
+            ipc_client.close()
+
+    delivered = asyncio.run(overlap())
+    assert sorted(n for _, n in delivered) == list(range(11))
+    assert {topic_filter for topic_filter, _ in delivered} == {'runscreen/#'}
+
+
+def test_released_filter_no_longer_delivers():
+    subscriptions = TopicSubscriptions(None, ['runscreen/topic'])
+    subscriptions.subscribers = {'runscreen/topic': None, 'runscreen/#': None}
+    assert not subscriptions.delivers('runscreen/topic', 'runscreen/topic')
+    del subscriptions.subscribers['runscreen/#']
+    assert subscriptions.delivers('runscreen/topic', 'runscreen/topic')
+    # a copy still queued from the released subscription
+    assert not subscriptions.delivers('runscreen/#', 'runscreen/topic')
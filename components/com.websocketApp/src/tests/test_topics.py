@@ -0,0 +1,61 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import pytest
+from topics import topic_matches, matches_any, canonical_filter, filter_covers, covered_by_any
+
+
+@pytest.mark.parametrize('topic_filter, topic, expected', [
+    ('runscreen/topic', 'runscreen/topic', True),
+    ('runscreen/topic', 'runscreen/other', False),
+    ('runscreen/+', 'runscreen/m1', True),
+    ('runscreen/+', 'runscreen/m1/tool', False),
+    ('runscreen/+', 'runscreen', False),
+    ('runscreen/+/tool', 'runscreen/m1/tool', True),
+    ('runscreen/#', 'runscreen/m1/tool', True),
+    ('runscreen/#', 'runscreen/m1', True),
+    ('runscreen/#', 'other/m1', False),
+    ('#', 'anything/at/all', True),
+    ('+/+', 'a/b', True),
+    ('runscreen/m1', 'runscreen/m1/tool', False),
+])
+def test_topic_matches(topic_filter, topic, expected):
+    assert topic_matches(topic_filter, topic) is expected
+
+
+def test_matches_any():
+    assert matches_any(['a/b', 'runscreen/+'], 'runscreen/m1')
+    assert not matches_any(['a/b', 'runscreen/+'], 'runscreen/m1/tool')
+    assert not matches_any([], 'a')
+
+
+def test_canonical_filter_is_the_same_whatever_the_order():
+    filters = ['runscreen/topic', 'runscreen/#', 'runscreen/+']
+    assert canonical_filter(filters, 'runscreen/topic') == 'runscreen/#'
+    assert canonical_filter(reversed(filters), 'runscreen/topic') == 'runscreen/#'
+    assert canonical_filter(filters, 'runscreen/m1/tool') == 'runscreen/#'
+    assert canonical_filter(filters, 'other/topic') is None
+
+
+@pytest.mark.parametrize('outer, inner, expected', [
+    ('runscreen/#', 'runscreen/#', True),
+    ('runscreen/#', 'runscreen/m1', True),
+    ('runscreen/#', 'runscreen/+/tool', True),
+    ('runscreen/+', 'runscreen/m1', True),
+    ('runscreen/+', 'runscreen/+', True),
+    ('runscreen/+', 'runscreen/#', False),
+    ('runscreen/+', 'runscreen/m1/tool', False),
+    ('runscreen/m1', 'runscreen/+', False),
+    ('runscreen/m1', 'runscreen/m1', True),
+    ('other/#', 'runscreen/m1', False),
+    ('#', 'runscreen/#', True),
+])
+def test_filter_covers(outer, inner, expected):
+    assert filter_covers(outer, inner) is expected
+
+
+def test_covered_by_any_is_the_topic_allowlist_check():
+    allowed = ['runscreen/#', 'plant/+/status']
+    assert covered_by_any(allowed, 'runscreen/m1')
+    assert covered_by_any(allowed, 'plant/line1/status')
+    assert not covered_by_any(allowed, 'plant/#')
+    assert not covered_by_any(allowed, '#')
@@ -0,0 +1,51 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+
+def topic_matches(topic_filter, topic):
+    """True if ``topic`` matches ``topic_filter``, which may use the MQTT
+    style ``+`` (one level) and ``#`` (all remaining levels) wildcards
+    supported by the Greengrass IPC pub/sub."""
+    if topic_filter == topic:
+        return True
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def matches_any(topic_filters, topic):
+    return any(topic_matches(f, topic) for f in topic_filters)
+
+
+def canonical_filter(topic_filters, topic):
+    """The one of ``topic_filters`` that passes on a message on ``topic``
+    when several of them match it, None when none does. Every overlapping
+    subscription gets its own copy of the message."""
+    matching = [f for f in topic_filters if topic_matches(f, topic)]
+    return min(matching) if matching else None
+
+
+def filter_covers(outer, inner):
+    """True if every topic matching the ``inner`` filter also matches the
+    ``outer`` filter."""
+    outer_levels = outer.split('/')
+    inner_levels = inner.split('/')
+    for i, level in enumerate(outer_levels):
+        if level == '#':
+            return True
+        if i >= len(inner_levels) or inner_levels[i] == '#':
+            return False
+        if level != '+' and (inner_levels[i] == '+' or level != inner_levels[i]):
+            return False
+    return len(outer_levels) == len(inner_levels)
+
+
+def covered_by_any(topic_filters, topic_filter):
+    return any(filter_covers(f, topic_filter) for f in topic_filters)
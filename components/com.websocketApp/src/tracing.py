@@ -0,0 +1,110 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Latency of every stage between the publisher and the browser.
+
+The publisher stamps each message with ``trace: {seq, mono}``, where
+``mono`` is ``time.monotonic()``. The monotonic clock is shared by the
+processes of one host, and the IPC pub/sub never leaves the host, so the
+publisher and this server can be compared directly. Stages:
+
+- ``publish_to_ipc``: publisher to StreamHandler.on_stream_event
+- ``ipc_to_loop``: IPC thread to the fan-out task on the event loop
+- ``loop_to_emit``: fan-out task to the frame handed to Socket.IO
+- ``emit_to_ack``: round trip until the browser acknowledges the frame
+- ``publish_to_emit``: end to end on the server side
+"""
+import collections
+import time
+
+STAGES = ('publish_to_ipc', 'ipc_to_loop', 'loop_to_emit', 'emit_to_ack', 'publish_to_emit')
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+
+class LatencyTracer:
+    """Keeps the last ``samples`` latencies per stage and counts the gaps in
+    the publisher sequence numbers."""
+
+    def __init__(self, samples=10000, pending=10000):
+        self.samples = {stage: collections.deque(maxlen=samples) for stage in STAGES}
+        self.pending = pending
+        # seq -> (publish time, dequeue time) and (sid, seq) -> emit time
+        self.dequeued = collections.OrderedDict()
+        self.emitted_at = collections.OrderedDict()
+        self.last_seq = {}
+        self.received = 0
+        self.gaps = 0
+        self.lost = 0
+
+    def record(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def dequeue(self, topic, message, received, seq):
+        """A message reached the fan-out task, ``received`` is when the IPC
+        thread got it and ``seq`` the frame sequence number."""
+        now = time.monotonic()
+        self.received += 1
+        self.record('ipc_to_loop', now - received)
+        trace = message.get('trace') if isinstance(message, dict) else None
+        published = None
+        if isinstance(trace, dict):
+            published = trace.get('mono')
+            if published is not None:
+                self.record('publish_to_ipc', received - published)
+            self._check_gap(topic, trace.get('seq'))
+        self.dequeued[seq] = (published, now)
+        self._trim(self.dequeued)
+
+    def emitted(self, sid, frames):
+        now = time.monotonic()
+        for frame in frames:
+            seq = frame.get('seq')
+            stamps = self.dequeued.get(seq)
+            if stamps is None:
+                continue
+            published, dequeued = stamps
+            self.record('loop_to_emit', now - dequeued)
+            if published is not None:
+                self.record('publish_to_emit', now - published)
+            self.emitted_at[(sid, seq)] = now
+        self._trim(self.emitted_at)
+
+    def acked(self, sid, seq):
+        emitted = self.emitted_at.pop((sid, seq), None)
+        if emitted is not None:
+            self.record('emit_to_ack', time.monotonic() - emitted)
+
+    def summary(self):
+        """p50/p95/p99/max in milliseconds per stage, and gap counts."""
+        stages = {}
+        for stage, samples in self.samples.items():
+            ordered = sorted(samples)
+            stages[stage] = {
+                'count': len(ordered),
+                'p50': _ms(percentile(ordered, 50)),
+                'p95': _ms(percentile(ordered, 95)),
+                'p99': _ms(percentile(ordered, 99)),
+                'max': _ms(ordered[-1] if ordered else None),
+            }
+        return {'stages': stages, 'received': self.received, 'gaps': self.gaps, 'lost': self.lost}
+
+    def _check_gap(self, topic, seq):
+        if seq is None:
+            return
+        last = self.last_seq.get(topic)
+        self.last_seq[topic] = seq
+        if last is not None and seq > last + 1:
+            self.gaps += 1
+            self.lost += seq - last - 1
+
+    def _trim(self, stamps):
+        while len(stamps) > self.pending:
+            stamps.popitem(last=False)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000.0, 3)
@@ -0,0 +1,56 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Engine.IO transport settings of the Socket.IO server.
+
+aiohttp negotiates permessage-deflate with every browser that offers it and
+then compresses every frame, including pings and the small ack frames where
+deflate costs more CPU than it saves bandwidth. The websocket wrapper below
+replaces the one of the engineio aiohttp driver to send frames shorter than
+WEBSOCKET_COMPRESSION_THRESHOLD uncompressed, which permessage-deflate allows
+frame by frame.
+"""
+from aiohttp.web import WebSocketResponse
+from engineio.async_drivers import aiohttp as aiohttp_driver
+import config as cfg
+
+
+def server_options():
+    """Keyword arguments of socketio.AsyncServer for the configured profile."""
+    return {
+        'transports': list(cfg.TRANSPORTS),
+        'ping_interval': cfg.PING_INTERVAL,
+        'ping_timeout': cfg.PING_TIMEOUT,
+        # long polling fallback, websocket frames are handled below
+        'http_compression': cfg.COMPRESSION,
+        'compression_threshold': cfg.COMPRESSION_THRESHOLD,
+        'logger': cfg.ENGINE_LOGGING,
+        'engineio_logger': cfg.ENGINE_LOGGING,
+    }
+
+
+class ThresholdDeflateWebSocket(aiohttp_driver.WebSocket):
+
+    async def __call__(self, environ):
+        request = environ['aiohttp.request']
+        self._sock = WebSocketResponse(max_msg_size=self.server.max_http_buffer_size, compress=cfg.COMPRESSION)
+        await self._sock.prepare(request)
+        self.environ = environ
+        await self.handler(self)
+        return self._sock
+
+    async def send(self, message):
+        writer = getattr(self._sock, '_writer', None)
+        if len(message) >= cfg.COMPRESSION_THRESHOLD or not getattr(writer, 'compress', 0):
+            return await super().send(message)
+        # frames are sent one at a time per socket, so the negotiated
+        # setting can be put back as soon as this one is written
+        compress, writer.compress = writer.compress, 0
+        try:
+            await super().send(message)
+        finally:
+            writer.compress = compress
+
+
+def install(sio):
+    """Use ThresholdDeflateWebSocket for the websocket connections of ``sio``."""
+    sio.eio._async = dict(sio.eio._async, websocket=ThresholdDeflateWebSocket)
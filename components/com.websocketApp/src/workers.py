@@ -0,0 +1,266 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Multi process mode, enabled with WEBSOCKET_WORKERS > 1.
+
+The parent process holds the IPC subscriptions and writes every message once
+into a SharedRing. WEBSOCKET_WORKERS worker processes serve the Socket.IO
+clients on the same port (SO_REUSEPORT, the kernel spreads the connections)
+and read the messages from the ring. Each worker is connected to the parent
+by a socket pair: the parent writes a byte to wake the workers up when it
+wrote messages, the workers send the topics their clients subscribe to and
+release as JSON lines. A worker exits when its socket pair closes, the
+parent stops the workers and frees the ring on SIGTERM or SIGINT.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+import serializer
+import config as cfg
+from ringbuffer import SharedRing, RingReader
+from topics import matches_any
+
+logger = logging.getLogger()
+
+
+class WorkerSubscriptions:
+    """Stand-in for TopicSubscriptions in a worker process: messages come
+    from the ring, subscriptions are held by the parent process."""
+
+    def __init__(self, permanent=()):
+        # topics the parent keeps subscribed anyway
+        self.permanent = set(permanent)
+        self.subscribers = set(permanent)
+        self.ring = None
+        self.reader = None
+        self.control = None
+        self.queue = None
+        self.loop = None
+
+    def attach(self, ring, control):
+        self.ring = ring
+        self.control = control
+
+    def start(self, lq, loop):
+        self.queue = lq
+        self.loop = loop
+        self.reader = RingReader(self.ring)
+        self.control.setblocking(False)
+        loop.add_reader(self.control.fileno(), self._wakeup)
+
+    def _wakeup(self):
+        try:
+            if not self.control.recv(4096):
+                logger.error("Worker lost its connection to the subscriber process, exiting")
+                self.loop.remove_reader(self.control.fileno())
+                # no more messages will come, web.run_app shuts down on SIGTERM
+                signal.raise_signal(signal.SIGTERM)
+                return
+        except BlockingIOError:
+            pass
+        for seq, topic_filter, topic, data, received in self.reader.poll():
+            self.queue.put_nowait((topic_filter, topic, serializer.decode(data), received, data, seq))
+
+    def subscribe(self, topic):
+        if topic in self.subscribers:
+            return
+        self.subscribers.add(topic)
+        self._send('subscribe', topic)
+
+    def delivers(self, topic_filter, topic):
+        """False for the ring messages no filter of this worker matches, the
+        parent writes one copy of each message whatever filters overlap."""
+        return matches_any(self.subscribers, topic)
+
+    def release(self, topic):
+        if topic in self.permanent or topic not in self.subscribers:
+            return
+        self.subscribers.discard(topic)
+        self._send('release', topic)
+
+    def _send(self, op, topic):
+        try:
+            self.control.sendall((json.dumps({'op': op, 'topic': topic}) + '\n').encode())
+        except Exception as e:
+            logger.error("Failed to send {} {} to the subscriber process - {}".format(op, topic, e))
+
+
+class WorkerPool:
+    """Starts the workers, writes the IPC messages to the ring and keeps one
+    IPC subscription per topic any worker needs.
+
+    A worker that exits is started again after a delay doubling from
+    ``restart_seconds`` with every quick exit in a row, and given up after
+    ``max_restarts`` of them."""
+
+    def __init__(self, subscriptions, target, count=cfg.WORKERS, restart_seconds=cfg.WORKER_RESTART_SECONDS,
+                 max_restarts=cfg.WORKER_MAX_RESTARTS):
+        self.subscriptions = subscriptions
+        self.target = target
+        self.count = count
+        self.restart_seconds = restart_seconds
+        self.max_restarts = max_restarts
+        self.ring = None
+        self.controls = {}
+        self.pending = {}
+        self.processes = {}
+        # index -> (quick exits in a row, start time of the current process)
+        self.restarts = {}
+        # topic -> workers whose clients watch it
+        self.holders = {}
+        self.context = multiprocessing.get_context('spawn')
+        self.stopping = None
+        self.failed = False
+
+    def start_worker(self, index):
+        parent, child = socket.socketpair()
+        # read by config.py when the worker imports the application
+        os.environ['WEBSOCKET_WORKER_INDEX'] = str(index)
+        process = self.context.Process(target=self.target, args=(self.ring.name, child),
+                                       name='websocket-worker-{}'.format(index), daemon=True)
+        process.start()
+        del os.environ['WEBSOCKET_WORKER_INDEX']
+        child.close()
+        parent.setblocking(False)
+        self.processes[index] = process
+        self.restarts[index] = (self.restarts.get(index, (0, 0.0))[0], time.monotonic())
+        self.controls[index] = parent
+        self.pending[index] = b''
+        asyncio.get_running_loop().add_reader(parent.fileno(), self._control, index)
+        logger.info("Started worker {} pid {}".format(index, process.pid))
+
+    def _control(self, index):
+        control = self.controls[index]
+        try:
+            data = control.recv(65536)
+        except BlockingIOError:
+            return
+        if not data:
+            self._lost(index)
+            return
+        lines = (self.pending[index] + data).split(b'\n')
+        self.pending[index] = lines.pop()
+        for line in lines:
+            try:
+                request = json.loads(line)
+                if request['op'] == 'subscribe':
+                    self.holders.setdefault(request['topic'], set()).add(index)
+                    self.subscriptions.subscribe(request['topic'])
+                else:
+                    self._release(request['topic'], index)
+            except Exception as e:
+                logger.error("Bad request {} from worker {} - {}".format(line, index, e))
+
+    def _release(self, topic, index):
+        holders = self.holders.get(topic, set())
+        holders.discard(index)
+        if not holders:
+            self.holders.pop(topic, None)
+            self.subscriptions.release(topic)
+
+    def _lost(self, index):
+        control = self.controls.pop(index)
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(control.fileno())
+        control.close()
+        process = self.processes.pop(index)
+        process.join(1)
+        for topic in [t for t, holders in self.holders.items() if index in holders]:
+            self._release(topic, index)
+        if self.stopping.is_set():
+            return
+        exits, started = self.restarts[index]
+        # a worker that ran for a while exited for some other reason than a broken start
+        exits = exits + 1 if time.monotonic() - started < 60 else 1
+        self.restarts[index] = (exits, started)
+        if exits > self.max_restarts:
+            logger.error("Worker {} exited with code {} after {} restarts in a row, not starting it again".format(
+                index, process.exitcode, exits - 1))
+            if all(n > self.max_restarts for n, _ in self.restarts.values()):
+                self.failed = True
+                self.stopping.set()
+            return
+        delay = self.restart_seconds * 2 ** (exits - 1)
+        logger.error("Worker {} exited with code {}, starting it again in {}s".format(index, process.exitcode, delay))
+        loop.call_later(delay, self._restart, index)
+
+    def _restart(self, index):
+        if not self.stopping.is_set():
+            self.start_worker(index)
+
+    def _stop_workers(self):
+        for process in self.processes.values():
+            process.terminate()
+        for index, process in list(self.processes.items()):
+            process.join(5)
+            if process.is_alive():
+                logger.error("Worker {} did not stop, killing it".format(index))
+                process.kill()
+                process.join()
+        for control in self.controls.values():
+            control.close()
+        self.processes.clear()
+        self.controls.clear()
+
+    def _notify(self):
+        for control in self.controls.values():
+            try:
+                control.send(b'\0')
+            except BlockingIOError:
+                # its buffer holds wake ups already
+                pass
+            except OSError as e:
+                logger.error("Failed to wake up a worker - {}".format(e))
+
+    async def _forward(self, q):
+        while True:
+            items = [await q.get()]
+            while not q.empty():
+                items.append(q.get_nowait())
+            for topic_filter, topic, payload, received, _, _ in items:
+                # one copy in the ring, numbered once for every worker
+                if not self.subscriptions.delivers(topic_filter, topic):
+                    continue
+                data = serializer.encode(payload).encode()
+                if self.ring.write(topic_filter, topic, data, received) is None:
+                    logger.error("Message of {} bytes on {} does not fit a ring slot of {} bytes".format(
+                        len(data), topic, self.ring.slot_size))
+            # one wake up per burst of messages
+            self._notify()
+
+    async def run(self):
+        """Runs until SIGTERM or SIGINT, or until every worker was given up,
+        then stops the workers and frees the ring."""
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.stopping.set)
+        self.ring = SharedRing.create()
+        forward = None
+        try:
+            q = asyncio.Queue()
+            self.subscriptions.start(q, loop)
+            for index in range(1, self.count + 1):
+                self.start_worker(index)
+            forward = asyncio.ensure_future(self._forward(q))
+            await asyncio.wait([forward, asyncio.ensure_future(self.stopping.wait())],
+                               return_when=asyncio.FIRST_COMPLETED)
+            if forward.done():
+                forward.result()
+            logger.info("Stopping {} workers".format(len(self.processes)))
+        finally:
+            self.stopping.set()
+            if forward is not None:
+                forward.cancel()
+            for control in self.controls.values():
+                loop.remove_reader(control.fileno())
+            self._stop_workers()
+            self.ring.close()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signum)
+        if self.failed:
+            raise RuntimeError("No worker left, every worker exited {} times in a row".format(self.max_restarts + 1))
@@ -58,12 +58,7 @@ function Job() {
       console.log("is socket connected", isConnected);
 
       subscribeToIpcResponse((err, data) => {
-        var response = data.data.replace(/'/g, '"');
-        response = response.replace("True", "true");
-        response = response.replace("False", "false");
-        response = response.replace(/: None/g, ': "None"');
-
-        setJobDetails(JSON.parse(response));
+        setJobDetails(data.message);
       });
     });
   }, []);
@@ -1,17 +1,76 @@
 import io from "socket.io-client";
+import { decodeCbor } from "./cbor";
 // import ipAddress from "../../IpAddress";
 
 let socket;
+// sequence number of the last runscreen message received, sent back on
+// reconnect so the server replays what we missed
+let lastSeq = null;
+// numbering lastSeq belongs to, the server starts over at 1 when it restarts
+let lastEpoch = null;
+// delta mode: recently applied messages per topic, by sequence number, that
+// the server can send patches against
+let useDelta = false;
+// acknowledge every message, lets the server measure the round trip
+let useAck = false;
+// ask for CBOR frames, numeric sensor values then arrive as numbers
+let useBinary = false;
+let deltaStates = {};
+const MAX_DELTA_STATES = 32;
+
+// apply JSON patch (replace/add/remove) operations to a copy of doc
+const applyPatch = (doc, ops) => {
+  let result = JSON.parse(JSON.stringify(doc));
+  ops.forEach((op) => {
+    const keys = op.path
+      .split("/")
+      .slice(1)
+      .map((key) => key.replace(/~1/g, "/").replace(/~0/g, "~"));
+    if (keys.length === 0) {
+      result = op.value;
+      return;
+    }
+    let target = result;
+    keys.slice(0, -1).forEach((key) => {
+      target = target[key];
+    });
+    const last = keys[keys.length - 1];
+    if (op.op === "remove") {
+      delete target[last];
+    } else {
+      target[last] = op.value;
+    }
+  });
+  return result;
+};
 
 //Emitter
-export const initiateSocket = async (isConnected) => {
+// options.topics: IPC topics (wildcards allowed) to watch, the server defaults when empty
+// options.delta: receive patches against the previous message instead of full messages
+// options.ack: acknowledge every message for the server latency stats
+// options.binary: CBOR frames instead of JSON, JSON if the server cannot encode them
+export const initiateSocket = async (
+  isConnected,
+  { topics = [], delta = false, ack = false, binary = false } = {}
+) => {
+  useDelta = delta;
+  useBinary = binary;
+  useAck = ack || delta;
   let ip = localStorage.getItem("IpAddress");
-  socket = io.connect(`http://${ip}:8080/`);
+  // websocket right away, the server does not serve long polling
+  socket = io.connect(`http://${ip}:8080/`, { transports: ["websocket"] });
   console.log(`Connecting socket from ip address ${ip}`);
 
   socket.on("connect", function () {
     console.log("publish_msg emitted");
-    socket.emit("publish_msg", { data: "" });
+    socket.emit("publish_msg", {
+      data: "",
+      topics: topics,
+      since_seq: lastSeq,
+      epoch: lastEpoch,
+      delta: useDelta,
+      encodings: useBinary ? ["cbor"] : [],
+    });
     return isConnected(socket.connected);
   });
   // socket.emit("my_event", { data: "I'm connected!" });
@@ -30,6 +89,24 @@ export const end_run = () => {
   socket.emit("end_run");
 };
 
+//Sensor trends: aggregates and a downsampled series per sensor field
+// window: "1m", "1h" or seconds
+export const requestSensorAggregates = (cb, topic, window = "1m", points = 200) => {
+  socket.once("sensor_aggregates_response", (msg) => cb(null, msg));
+  socket.emit("sensor_aggregates", { topic: topic, window: window, points: points });
+};
+
+//Latency percentiles per stage, publisher to browser
+export const requestLatencyStats = (cb) => {
+  socket.once("latency_stats_response", (msg) => cb(null, msg));
+  socket.emit("latency_stats");
+};
+
+//Stop watching topics
+export const unsubscribeTopics = (topics) => {
+  socket.emit("unsubscribe_topics", { topics: topics });
+};
+
 //Disconnect
 export const disconnectSocket = () => {
   console.log("Disconnecting socket...");
@@ -43,10 +120,69 @@ export const disconnectSocket = () => {
 export const subscribeToIpcResponse = (cb) => {
   console.log("subscribing to IPC response");
 
+  // the callback gets the frame with its decoded message in msg.message
+  const receive = (msg) => {
+    if (msg.epoch != null && msg.epoch !== lastEpoch) {
+      // the server restarted, sequence numbers and delta bases start over
+      lastEpoch = msg.epoch;
+      lastSeq = null;
+      deltaStates = {};
+    }
+    // replayed and live messages can overlap after a reconnect
+    if (msg.seq != null && lastSeq != null && msg.seq <= lastSeq) return;
+
+    let message;
+    if (msg.patch != null) {
+      const base = (deltaStates[msg.topic] || {})[msg.base];
+      if (base === undefined) {
+        socket.emit("resync", { topic: msg.topic });
+        return;
+      }
+      message = applyPatch(base, JSON.parse(msg.patch));
+    } else if (msg.encoding === "cbor") {
+      message = decodeCbor(msg.data);
+    } else {
+      message = JSON.parse(msg.data);
+    }
+
+    if (msg.seq != null) {
+      lastSeq = msg.seq;
+      if (useDelta) {
+        const states = (deltaStates[msg.topic] = deltaStates[msg.topic] || {});
+        states[msg.seq] = message;
+        const seqs = Object.keys(states).map(Number);
+        if (seqs.length > MAX_DELTA_STATES) {
+          delete states[Math.min(...seqs)];
+        }
+      }
+      if (useAck) {
+        socket.emit("ack", { topic: msg.topic, seq: msg.seq });
+      }
+    }
+    return cb(null, { ...msg, message: message });
+  };
+
   socket.on("ipc_response", (msg) => {
     console.log("IPC response received");
 
-    return cb(null, msg);
+    return receive(msg);
+  });
+
+  // batched mode and replays: one frame carries several messages
+  socket.on("ipc_response_batch", (msg) => {
+    console.log(`IPC response batch of ${msg.data.length} received`);
+
+    msg.data.forEach((data, i) =>
+      receive({
+        data: data,
+        seq: msg.seq[i],
+        topic: msg.topic[i],
+        patch: msg.patch ? msg.patch[i] : null,
+        base: msg.base ? msg.base[i] : null,
+        encoding: msg.encoding ? msg.encoding[i] : null,
+        epoch: msg.epoch,
+      })
+    );
   });
 };
 
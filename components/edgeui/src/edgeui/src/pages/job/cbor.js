@@ -0,0 +1,97 @@
+// Minimal CBOR (RFC 8949) decoder for the binary ipc_response frames:
+// integers, floats, strings, byte strings, arrays, maps and simple values.
+
+const utf8 = new TextDecoder();
+
+export const decodeCbor = (buffer) => {
+  const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  let offset = 0;
+
+  const float16 = (half) => {
+    const exponent = (half >> 10) & 0x1f;
+    const fraction = half & 0x3ff;
+    const sign = half & 0x8000 ? -1 : 1;
+    if (exponent === 0) return sign * 2 ** -14 * (fraction / 1024);
+    if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+    return sign * 2 ** (exponent - 15) * (1 + fraction / 1024);
+  };
+
+  const length = (info) => {
+    if (info < 24) return info;
+    let value;
+    if (info === 24) {
+      value = view.getUint8(offset);
+      offset += 1;
+    } else if (info === 25) {
+      value = view.getUint16(offset);
+      offset += 2;
+    } else if (info === 26) {
+      value = view.getUint32(offset);
+      offset += 4;
+    } else if (info === 27) {
+      value = Number(view.getBigUint64(offset));
+      offset += 8;
+    } else {
+      throw new Error(`Unsupported CBOR length ${info}`);
+    }
+    return value;
+  };
+
+  const item = () => {
+    const initial = view.getUint8(offset);
+    offset += 1;
+    const major = initial >> 5;
+    const info = initial & 0x1f;
+    if (major === 7) {
+      if (info === 20) return false;
+      if (info === 21) return true;
+      if (info === 22 || info === 23) return null;
+      let value;
+      if (info === 25) {
+        value = float16(view.getUint16(offset));
+        offset += 2;
+      } else if (info === 26) {
+        value = view.getFloat32(offset);
+        offset += 4;
+      } else if (info === 27) {
+        value = view.getFloat64(offset);
+        offset += 8;
+      } else {
+        throw new Error(`Unsupported CBOR simple value ${info}`);
+      }
+      return value;
+    }
+    const n = length(info);
+    switch (major) {
+      case 0:
+        return n;
+      case 1:
+        return -1 - n;
+      case 2:
+        offset += n;
+        return bytes.subarray(offset - n, offset);
+      case 3:
+        offset += n;
+        return utf8.decode(bytes.subarray(offset - n, offset));
+      case 4: {
+        const array = new Array(n);
+        for (let i = 0; i < n; i++) array[i] = item();
+        return array;
+      }
+      case 5: {
+        const map = {};
+        for (let i = 0; i < n; i++) {
+          const key = item();
+          map[key] = item();
+        }
+        return map;
+      }
+      default:
+        // tags (major type 6): the tagged item itself
+        return item();
+    }
+  };
+
+  return item();
+};